@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+
+""" AIS filter rules
+
+Rules come from the config (cfg.AIS_RULES) as a list of strings.  Each rule is
+an action followed by one or more conditions joined by "and":
+
+    allow mmsi 235012345 235067890          our own fleet and buddy boats
+    allow type 60-69 80-89                  passenger ships and tankers
+    deny type 36 37                         sailing and pleasure craft
+    deny mid 503                            vessels registered in Australia
+    deny class B and length <12             small Class B targets
+    deny length <20 unknown                 short or unknown length
+
+Fields are mmsi, mid (the country prefix of the MMSI), type (ship type), class
+(A or B) and length (metres).  Values are numbers, ranges (20-50), comparisons
+(<20, <=20, >100, >=100) or "unknown", which matches a vessel we have not heard
+that attribute for yet.  A condition matches if the vessel matches any of its
+values.  Rules are tried in order, the first match wins, and if nothing matches
+the default action (cfg.AIS_DEFAULT_ACTION) applies.
+
+Rules are compiled once at load time.  type, mid and class values become
+bitmasks, and mmsi and length become a frozenset of single values plus sorted
+ranges searched with bisect.  Checking a rule is then a few lookups against the
+vessel attributes in the MMSI cache, and the verdict is cached per vessel until
+one of its attributes changes.
+
+"""
+
+import logging
+from bisect import bisect_right
+
+LOGGER = logging.getLogger(__name__)
+
+ACTIONS = {"allow": True, "deny": False}
+
+# Bitmask fields and the largest value each can hold
+BITMASK_FIELDS = {"type": 255, "mid": 999, "class": 1}
+RANGE_FIELDS = ("mmsi", "length")
+
+# Class values are stored as bit numbers
+VESSEL_CLASSES = {"A": 0, "B": 1}
+
+# AIS message types sent by Class A and Class B transponders
+CLASS_A_MSG_TYPES = frozenset({1, 2, 3, 5})
+CLASS_B_MSG_TYPES = frozenset({18, 19, 24})
+
+NO_LIMIT = float("inf")
+
+
+def vessel_class(msg_type):
+    """Class A (0), Class B (1) or None if the message type does not tell us"""
+    if msg_type in CLASS_A_MSG_TYPES:
+        return VESSEL_CLASSES["A"]
+    if msg_type in CLASS_B_MSG_TYPES:
+        return VESSEL_CLASSES["B"]
+    return None
+
+
+def mid_of(mmsi):
+    """Maritime Identification Digits (country) of an MMSI, or None.
+    Ships are MIDxxxxxx, coast stations 00MIDxxxx, craft associated with a ship
+    98MIDxxxx, AtoNs 99MIDxxxx, handhelds 8MIDxxxxx and SAR aircraft 111MIDxxx.
+    """
+    if 200000000 <= mmsi < 800000000:
+        return mmsi // 1000000
+    if 800000000 <= mmsi < 900000000:
+        return mmsi // 100000 % 1000
+    if mmsi < 10000000 or 980000000 <= mmsi < 1000000000:
+        return mmsi // 10000 % 1000
+    if 111000000 <= mmsi < 112000000:
+        return mmsi // 1000 % 1000
+    return None
+
+
+def parse_value(token, field):
+    """Turn one value token into an inclusive (low, high) range"""
+    if field == "class":
+        if token.upper() not in VESSEL_CLASSES:
+            raise ValueError(f"class must be A or B, not {token!r}")
+        bit = VESSEL_CLASSES[token.upper()]
+        return bit, bit
+
+    for prefix, low, high in (
+        ("<=", None, 0), ("<", None, -1), (">=", 0, None), (">", 1, None)
+    ):
+        if token.startswith(prefix):
+            number = int(token[len(prefix):])
+            if low is None:
+                return 0, number + high
+            return number + low, NO_LIMIT
+
+    if "-" in token:
+        low, high = token.split("-", 1)
+        return int(low), int(high)
+    return int(token), int(token)
+
+
+class BitmaskMatcher:
+    """Match small integer values (type, mid, class) with one bitmask"""
+    __slots__ = ("mask", "unknown")
+
+    def __init__(self, ranges, unknown, limit):
+        self.unknown = unknown
+        self.mask = 0
+        for low, high in ranges:
+            if low > high:
+                raise ValueError(f"{low}-{high} is an empty range")
+            if low < 0 or low > limit:
+                raise ValueError(f"{low} is out of range 0-{limit}")
+            high = min(high, limit)
+            self.mask |= ((1 << (high - low + 1)) - 1) << low
+
+    def __call__(self, value):
+        if value is None:
+            return self.unknown
+        return self.mask >> value & 1 == 1
+
+
+class RangeMatcher:
+    """Match large integer values (mmsi, length) with a frozenset and sorted ranges"""
+    __slots__ = ("values", "starts", "ends", "unknown")
+
+    def __init__(self, ranges, unknown):
+        self.unknown = unknown
+        self.values = frozenset(low for low, high in ranges if low == high)
+
+        # Merge overlapping ranges so each value falls in at most one
+        merged = []
+        for low, high in sorted((low, high) for low, high in ranges if low != high):
+            if low > high:
+                raise ValueError(f"{low}-{high} is an empty range")
+            if merged and low <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+        self.starts = [low for low, _ in merged]
+        self.ends = [high for _, high in merged]
+
+    def __call__(self, value):
+        if value is None:
+            return self.unknown
+        if value in self.values:
+            return True
+        index = bisect_right(self.starts, value) - 1
+        return index >= 0 and value <= self.ends[index]
+
+
+def compile_condition(field, tokens):
+    """Compile one field and its values into a matcher"""
+    if field not in BITMASK_FIELDS and field not in RANGE_FIELDS:
+        raise ValueError(f"unknown field {field!r}")
+    if not tokens:
+        raise ValueError(f"no values for {field}")
+    unknown = "unknown" in tokens
+    ranges = [parse_value(token, field) for token in tokens if token != "unknown"]
+    if field in BITMASK_FIELDS:
+        return BitmaskMatcher(ranges, unknown, BITMASK_FIELDS[field])
+    return RangeMatcher(ranges, unknown)
+
+
+def compile_rule(rule):
+    """Compile a rule string to (allow, ((field, matcher), ...))"""
+    tokens = rule.split()
+    if not tokens or tokens[0] not in ACTIONS:
+        raise ValueError(f"Bad AIS rule {rule!r}: must start with allow or deny")
+
+    conditions = []
+    groups = [[]]
+    for token in tokens[1:]:
+        if token == "and":
+            groups.append([])
+        else:
+            groups[-1].append(token)
+    for group in groups:
+        if not group:
+            raise ValueError(f"Bad AIS rule {rule!r}: missing condition")
+        try:
+            conditions.append((group[0], compile_condition(group[0], group[1:])))
+        except ValueError as err:
+            raise ValueError(f"Bad AIS rule {rule!r}: {err}") from err
+    return ACTIONS[tokens[0]], tuple(conditions)
+
+
+class AisRules:
+    """Compiled AIS filter rules"""
+    def __init__(self, rules, default_action="allow"):
+        if default_action not in ACTIONS:
+            raise ValueError(f"AIS default action must be allow or deny, not {default_action!r}")
+        self.default = ACTIONS[default_action]
+        self.rules = tuple(compile_rule(rule) for rule in rules)
+        LOGGER.info("AIS rules: %s rules, default %s", len(self.rules), default_action)
+
+    def allows(self, vessel):
+        """True if the vessel (a MMSI cache entry) passes the rules"""
+        for allow, conditions in self.rules:
+            for field, matcher in conditions:
+                if not matcher(vessel[field]):
+                    break
+            else:
+                return allow
+        return self.default
@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+
+""" GPS source selection
+
+We may hear GPS sentences from more than one source (e.g. a USB GPS and the GPS
+sentences in the AIS transponder feed).  GpsFusion tracks the fix quality and
+age of each source from GGA, RMC, GSA and GLL and picks the best live source.
+Only the selected source's position sentences (POSITION_TYPES) are passed on,
+and the latest sentence of each type from that source can be emitted as one
+consolidated set.  Other sentences (GSV, ZDA, APB, RMB...) are not touched.
+
+Selection rules:
+
+1. A source is live if it has reported a valid fix within max_age seconds.
+   Until any source is live we pass through the first source we heard.
+2. We stay on the selected source while it is live, unless another live source
+   has a better class of fix (3D vs 2D, or DGPS/RTK vs plain GPS).
+3. If the selected source goes stale we fail over to the best live source,
+   ranked by fix class then satellites used then HDOP.
+
+"""
+
+import logging
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# Sentences that make up a consolidated position set, in the order we emit them
+POSITION_TYPES = (b"RMC", b"GGA", b"GSA", b"GLL", b"VTG")
+
+# GGA fix quality values that mean a differential or RTK fix
+DIFFERENTIAL_QUALITY = frozenset({b"2", b"4", b"5"})
+
+
+def is_gps(data):
+    """True for $GP, $GN, $GL, $GA, $GB sentences"""
+    return data[:2] == b"$G" and len(data) > 6
+
+
+def is_position(data):
+    """True for GPS sentences that are part of a position fix (POSITION_TYPES)"""
+    return is_gps(data) and data[3:6] in POSITION_TYPES
+
+
+def fields_of(data):
+    """Split a sentence into fields with the checksum removed"""
+    star = data.rfind(b"*")
+    if star > 0:
+        data = data[:star]
+    return data.split(b",")
+
+
+class SourceState:
+    """What we know about one GPS source"""
+    __slots__ = ("name", "latest", "fix_ts", "has_fix", "fix_mode", "differential", "sats", "hdop")
+
+    def __init__(self, name):
+        self.name = name
+        self.latest = {}
+        self.fix_ts = 0
+        self.has_fix = False
+        self.fix_mode = 1
+        self.differential = False
+        self.sats = 0
+        self.hdop = 99.0
+
+    def fix_class(self):
+        """Coarse fix quality used to decide whether to switch source"""
+        return (self.has_fix, self.fix_mode, self.differential)
+
+    def rank(self):
+        """Fine fix quality used to pick between live sources"""
+        return (self.has_fix, self.fix_mode, self.differential, self.sats, -self.hdop)
+
+    def update(self, msg_type, fields, now):
+        """Update the fix quality from a sentence"""
+        try:
+            if msg_type == b"GGA":
+                quality = fields[6]
+                self.has_fix = quality not in (b"", b"0")
+                self.differential = quality in DIFFERENTIAL_QUALITY
+                self.sats = int(fields[7] or 0)
+                self.hdop = float(fields[8] or 99.0)
+            elif msg_type == b"RMC":
+                self.has_fix = fields[2] == b"A"
+            elif msg_type == b"GSA":
+                self.fix_mode = int(fields[2] or 1)
+                if self.fix_mode == 1:
+                    self.has_fix = False
+            elif msg_type == b"GLL":
+                self.has_fix = fields[6][:1] == b"A"
+            else:
+                return
+        except (IndexError, ValueError):
+            return
+
+        if self.has_fix:
+            self.fix_ts = now
+
+
+class GpsFusion:
+    """Track GPS sources and select the best one"""
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self.sources = {}
+        self.selected = None
+
+    def is_live(self, source, now):
+        """Valid fix heard recently"""
+        return source.has_fix and now - source.fix_ts < self.max_age
+
+    def select(self, now):
+        """Keep the current source if it is good enough, otherwise fail over"""
+        current = self.selected
+        live = [source for source in self.sources.values() if self.is_live(source, now)]
+        if not live:
+            return
+
+        best = max(live, key=SourceState.rank)
+        if current is None or not self.is_live(current, now):
+            new = best
+        elif best.fix_class() > current.fix_class():
+            new = best
+        else:
+            return
+
+        if new is not current:
+            LOGGER.warning(
+                "GPS source: %s -> %s (fix=%s mode=%s sats=%s hdop=%s)",
+                current.name if current else None, new.name, new.has_fix, new.fix_mode, new.sats, new.hdop
+            )
+            self.selected = new
+
+    def update(self, source_name, data, now=None):
+        """Record a GPS sentence.  Returns True if it came from the selected source"""
+        now = now or time.time()
+        source = self.sources.get(source_name)
+        if source is None:
+            source = self.sources[source_name] = SourceState(source_name)
+
+        fields = fields_of(data)
+        msg_type = fields[0][3:6]
+        source.update(msg_type, fields, now)
+        if msg_type in POSITION_TYPES:
+            source.latest[msg_type] = data
+
+        self.select(now)
+        if self.selected is None:
+            # Nobody has a fix yet.  Pass one source through so outputs still see
+            # its (no fix) sentences until a live source turns up.
+            self.selected = source
+        return source is self.selected
+
+    def consolidated(self):
+        """Latest position sentences from the selected source"""
+        if self.selected is None:
+            return []
+        latest = self.selected.latest
+        return [latest[msg_type] for msg_type in POSITION_TYPES if msg_type in latest]
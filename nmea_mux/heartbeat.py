@@ -0,0 +1,150 @@
+#! /usr/bin/env python3
+
+""" Heartbeats and the systemd watchdog
+
+Every channel worker and the main loop beat a Heartbeat on each pass round
+their loop.  The Watchdog thread checks that every active heartbeat is fresh
+and only then sends WATCHDOG=1 to systemd.  If any loop stops beating (e.g. a
+thread wedged in sendall or readline) it is named in the log, the channel
+supervisor restarts it, and if it does not recover systemd restarts the service
+(WatchdogSec in files/nmea_mux.service.template).
+
+Each heartbeat also records the time between beats, i.e. how long each pass
+round the loop takes, and the watchdog logs those timings periodically.
+
+Outside systemd (no NOTIFY_SOCKET) sd_notify() does nothing.
+
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+HEARTBEATS = {}
+
+
+class Heartbeat:
+    """Liveness and loop timing for one loop"""
+    __slots__ = ("name", "active", "last_ts", "iterations", "total_gap", "max_gap")
+
+    def __init__(self, name):
+        self.name = name
+        self.active = True
+        self.last_ts = time.monotonic()
+        self.iterations = 0
+        self.total_gap = 0.0
+        self.max_gap = 0.0
+
+    def beat(self):
+        """Call once per pass round the loop"""
+        now = time.monotonic()
+        gap = now - self.last_ts
+        self.last_ts = now
+        self.iterations += 1
+        self.total_gap += gap
+        if gap > self.max_gap:
+            self.max_gap = gap
+
+    def age(self, now=None):
+        """Seconds since the last beat"""
+        return (now or time.monotonic()) - self.last_ts
+
+    def stop(self):
+        """The loop has finished on purpose so stop watching it"""
+        self.active = False
+
+    def timings(self):
+        """Return (iterations, mean gap, max gap) since the last call and reset them"""
+        iterations, total_gap, max_gap = self.iterations, self.total_gap, self.max_gap
+        self.iterations = 0
+        self.total_gap = 0.0
+        self.max_gap = 0.0
+        return iterations, total_gap / iterations if iterations else 0.0, max_gap
+
+
+def register(name):
+    """Create a heartbeat, replacing any previous one with the same name"""
+    heartbeat = Heartbeat(name)
+    HEARTBEATS[name] = heartbeat
+    return heartbeat
+
+
+def sd_notify(message):
+    """Send a message (e.g. READY=1, WATCHDOG=1) to systemd.  Returns True if sent"""
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        # Abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            # Never let a backed up notify socket hold up the watchdog thread
+            sock.setblocking(False)
+            sock.connect(address)
+            sock.sendall(message.encode())
+    except OSError as err:
+        LOGGER.error("sd_notify failed: %s", err)
+        return False
+    return True
+
+
+def watchdog_interval(default):
+    """Half the systemd watchdog timeout if systemd set one, otherwise default"""
+    usec = os.environ.get("WATCHDOG_USEC")
+    if usec and usec.isdigit():
+        return int(usec) / 2e6
+    return default
+
+
+class Watchdog:
+    """Ping systemd only while every active heartbeat is fresh"""
+    def __init__(self, timeout, interval, report_interval, stop_event):
+        self.timeout = timeout
+        self.interval = interval
+        self.report_interval = report_interval
+        self.stop_event = stop_event
+
+    def stalled(self):
+        """Heartbeats that have not beaten within the timeout"""
+        now = time.monotonic()
+        return [hb for hb in list(HEARTBEATS.values()) if hb.active and hb.age(now) > self.timeout]
+
+    def check(self):
+        """Ping systemd if everything is healthy, otherwise name the stalled loops"""
+        stalled = self.stalled()
+        for heartbeat in stalled:
+            LOGGER.error("STALLED: %s, no heartbeat for %.1fs", heartbeat.name, heartbeat.age())
+        if not stalled:
+            sd_notify("WATCHDOG=1")
+        return not stalled
+
+    def report(self):
+        """Log the loop timings for every active heartbeat"""
+        for heartbeat in list(HEARTBEATS.values()):
+            if not heartbeat.active:
+                continue
+            iterations, mean_gap, max_gap = heartbeat.timings()
+            LOGGER.info(
+                "LOOP %s: iterations=%d mean=%.1fms max=%.1fms",
+                heartbeat.name, iterations, mean_gap * 1000, max_gap * 1000
+            )
+
+    def run(self):
+        """Check every interval until stop_event is set"""
+        last_report_ts = time.monotonic()
+        while not self.stop_event.wait(self.interval):
+            self.check()
+            if time.monotonic() - last_report_ts > self.report_interval:
+                last_report_ts = time.monotonic()
+                self.report()
+
+    def start_thread(self):
+        """Start the watchdog thread"""
+        wd_thread = threading.Thread(target=self.run, name="Watchdog", daemon=True)
+        wd_thread.start()
+        return wd_thread
@@ -4,6 +4,7 @@
 """
 
 INPUT_TCP_PORT = 12000
+INPUT_UDP_PORT = 12001
 NMEA_PORT = 10110
 
 NMEA_BUS_BAUD = 4800
@@ -16,13 +17,61 @@ AIS_DEV = "/dev/ttyS1"
 GPS_BAUD = 4800
 GPS_DEV = "/dev/ttyUSB0"
 
+# Stages each sentence passes through on its way to the mux channels, in order.
+# See the @register_stage functions in nmea_mux2.py.  Without "decode" pyais is
+# never imported and AIS filtering and decimation pass everything.
+#   validate    drop sentences with a bad checksum
+#   gps         pass on GPS position sentences from the best source only, at each
+#               channel's gps_rate
+#   decode      extract mmsi, length, message and ship type from AIS sentences,
+#               holding multipart messages until they are complete
+#   track       update the MMSI cache
+#   ais_filter  drop AIS targets denied by AIS_RULES
+#   route       send to the mux channels (with per channel decimation)
+PIPELINE_STAGES = ["gps", "decode", "track", "ais_filter", "route"]
+
+# AIS filter rules, first match wins (see ais_rules.py).  Fields are mmsi, mid,
+# type, class and length.  Values are numbers, ranges (60-69), <n, <=n, >n, >=n
+# or unknown.  Conditions can be joined with "and".  e.g.
+#   "allow mmsi 235012345 235067890"    our own fleet and buddy boats
+#   "allow type 60-69 80-89"            passenger ships and tankers
+#   "deny type 36 37"                   sailing and pleasure craft
+#   "deny mid 503"                      Australian flagged vessels
+#   "deny class B and length <12"       small Class B targets
+#   "deny length unknown"               vessels we have no length for yet
+AIS_RULES = [
+    "deny length <20",
+]
+AIS_DEFAULT_ACTION = "allow"
+
+# A GPS source without a valid fix for this long is failed over
+GPS_MAX_AGE = 3  # Seconds
+
+# Repeated AIS payloads are decoded once and cached.  ~200 bytes per entry
+DECODE_CACHE_ENTRIES = 4096
+
+# Failed channels are restarted with exponential backoff capped at this
+SUPERVISOR_MAX_BACKOFF = 30  # Seconds
+
+# A loop that has not beaten its heartbeat for HEARTBEAT_TIMEOUT is stalled.  We
+# ping the systemd watchdog every WATCHDOG_INTERVAL (or half of WatchdogSec if set)
+HEARTBEAT_TIMEOUT = 10  # Seconds
+WATCHDOG_INTERVAL = 5  # Seconds
+LOOP_REPORT_INTERVAL = 60  # Seconds
+
+# kill -USR1 profiles all threads for PROFILE_DURATION, kill -USR2 dumps stacks
+PROFILE_DIR = "/tmp"
+PROFILE_DURATION = 30  # Seconds
+
 ALL_NICS = "0.0.0.0"
 PHONE_IP = "_gateway"
+NMEA_MULTICAST_GROUP = "239.192.0.10"
 
 TCP_NAVIONICS = {
     "type": "TCP",
     "is_mux": True,
     "address": (ALL_NICS, NMEA_PORT),
+    "gps_rate": 5,  # Hz
     "name": "TCP to Navionics"
 }
 
@@ -30,7 +79,13 @@ UDP_NAVIONICS = {
     "type": "UDP",
     "is_mux": True,
     "address": (ALL_NICS, NMEA_PORT),  # We don't really car about this for UDP
-    "send_to": (PHONE_IP, NMEA_PORT),
+    # One (host, port) tuple or a list of them.  Names are resolved at startup
+    # and re-resolved periodically, not per packet.
+    "send_to": [(PHONE_IP, NMEA_PORT)],
+    # Optionally also send to a multicast group so any device can join
+    # "multicast": (NMEA_MULTICAST_GROUP, NMEA_PORT),
+    # "multicast_ttl": 1,
+    "gps_rate": 5,  # Hz
     "name": "UDP to Navionics"
 }
 
@@ -41,6 +96,11 @@ UART_MUX = {
     "baud": NMEA_BUS_BAUD,
     "name": "UART MUX",
     "address": "/dev/ttyS0",
+    # Forward at most one position report per vessel every 30s.  The plotter and
+    # VHF don't need more and it keeps the 4800 baud bus from saturating.
+    "decimate_interval": 30,
+    # One set of position sentences per second is plenty for the VHF
+    "gps_rate": 1,  # Hz
     # "address": "/dev/tty.usbserial-FT9FV3Y3",
 }
 
@@ -51,6 +111,14 @@ TCP_LISTEN = {
     "name": "TCP Input"
 }
 
+UDP_LISTEN = {
+    "type": "UDP",
+    "is_mux": False,
+    "address": (ALL_NICS, INPUT_UDP_PORT),
+    "rcvbuf": 1 << 20,  # Bytes.  Raise net.core.rmem_max to allow more than the default
+    "name": "UDP Input"
+}
+
 UART_GPS_LISTEN = {
     "type": "SERIAL",
     "is_mux": False,
@@ -67,12 +135,37 @@ UART_AIS_LISTEN = {
     "name": "AIS from VHF"
 }
 
+# For OpenCPN, loggers etc. running on this machine.  Cheaper than TCP loopback
+UNIX_LOCAL = {
+    "type": "UNIX",
+    "is_mux": True,
+    "socket_type": "stream",  # or "dgram" with "send_to": [<consumer socket paths>]
+    "path": "/tmp/nmea_mux.sock",
+    "name": "Unix socket to local apps"
+}
+
+SHM_LOCAL = {
+    "type": "SHM",
+    "is_mux": True,
+    "shm_name": "nmea_mux",  # Follow with: python3 shm_ring.py nmea_mux
+    "capacity": 1 << 20,
+    "name": "Shared memory to local apps"
+}
+
+# nmea_mux_sharded.py only.  Output channels listed together share a process,
+# any not listed get a process each.  e.g. [["UART MUX"], ["UDP to Navionics", "TCP to Navionics"]]
+OUTPUT_GROUPS = []
+SHARDED_RING_CAPACITY = 1 << 20  # Bytes per ring
+
 CHANNELS = [
     # SERIAL_MUX,
     UART_AIS_LISTEN,
     UART_GPS_LISTEN,
     UART_MUX,
     # TCP_LISTEN,
+    # UDP_LISTEN,
     # TCP_NAVIONICS,
-    UDP_NAVIONICS
+    UDP_NAVIONICS,
+    # UNIX_LOCAL,
+    # SHM_LOCAL,
 ]
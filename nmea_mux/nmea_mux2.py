@@ -30,23 +30,82 @@ mmsi =  Maritime Mobile Service Identity
 
 AIS Filtering Rules:
 
-1. Only show vessels that have a known length that is greater than a minimum length
+The ais_filter stage applies the allow/deny rules in cfg.AIS_RULES (see ais_rules.py)
+e.g. pass our own fleet and all tankers, drop pleasure craft and short vessels.
 
-MMSI is in every message.  Length and vessel name are only sent occasionally.
-We can cache the mmsi, length and msg timestamp.
+MMSI is in every message.  Length and ship type are only sent occasionally.
+We cache them per MMSI with the msg timestamp and the rules verdict.
 If timestamp is old then remove it from the cache.
 
+Class A length and ship type come in type 5 static reports, which are sent as two
+sentences.  The decode stage holds the first sentence until the second arrives and
+passes the whole message on as one item, so it is decoded, filtered and routed
+together.
+
+Pipeline:
+
+Sentences from DATA_QUEUE go through the stages named in cfg.PIPELINE_STAGES (see
+pipeline.py).  The stages are registered below with @register_stage.  Per stage
+timings are logged every CACHE_PURGE_INTERVAL.
+
+Local consumers:
+
+OpenCPN or a logger on the same machine can use a UNIX channel (stream or datagram
+Unix domain socket) or a SHM channel (shared memory ring, see shm_ring.py) rather
+than TCP loopback.  Both are output only and never block on a slow reader.
+
+Profiling:
+
+SIGUSR1 profiles all threads for cfg.PROFILE_DURATION seconds (a second SIGUSR1
+stops it early) and SIGUSR2 dumps the stack of every thread.  Results go to
+timestamped files in cfg.PROFILE_DIR.  See profiling.py.
+
+Watchdog:
+
+Every channel worker loop and the main loop beat a heartbeat (see heartbeat.py).
+The channel supervisor restarts a channel whose heartbeat goes stale for
+cfg.HEARTBEAT_TIMEOUT, and under systemd (Type=notify) we send READY=1 once the
+channels are started and WATCHDOG=1 only while every heartbeat is fresh, so a
+wedged main loop gets the service restarted.  Loop timings are logged every
+cfg.LOOP_REPORT_INTERVAL.
+
+Startup:
+
+pyais is slow to import on a Pi SD card so we load it in the background only if the
+pipeline has a decode stage.  Channels start listening straight
+away and pass data through unfiltered until the decoder is ready.  Use lazy_import()
+for any other heavy or optional dependency so it is only loaded when enabled.
+
 """
+import importlib
 import logging
+import os
+import select
+import signal
+import socket
 import socketserver
+import stat
 
 import threading
 import time
-from queue import Queue
+from collections import OrderedDict
+from queue import Empty, Queue
 
-import nmea_config as cfg
-import pyais
-import serial
+IMPORT_START_TS = time.perf_counter()
+
+import nmea_config as cfg  # noqa: E402
+import serial  # noqa: E402
+import ais_rules  # noqa: E402
+import gps_fusion  # noqa: E402
+import heartbeat  # noqa: E402
+from pipeline import Pipeline, Sentence, register_stage  # noqa: E402
+
+# Seconds spent importing modules, reported at startup
+IMPORT_TIMES = {"startup modules": time.perf_counter() - IMPORT_START_TS}
+
+# Loaded on demand by load_ais_decoder()
+pyais = None  # pylint: disable=invalid-name
+AIS_DECODER_READY = threading.Event()
 
 
 MAX_Q_SIZE = 100
@@ -58,16 +117,94 @@ STOP_THREADS.clear()
 
 LOGGER = logging.getLogger(__name__)
 
-MIN_SHIP_LENGTH = 20
 CACHE_PURGE_INTERVAL = 10  # Seconds
 
+# AIS message types subject to per-MMSI decimation.  Position reports only
+# (Class A 1-3, Class B 18-19, long range 27).  Static and safety messages
+# (5, 12, 14, 24) and anything we cannot decode always pass.
+DECIMATE_MSG_TYPES = frozenset({1, 2, 3, 18, 19, 27})
+DECIMATE_MAX_VESSELS = 2000
+
+# Multipart AIS messages being reassembled.  Incomplete messages are dropped
+# after MULTIPART_MAX_AGE or when more than MULTIPART_MAX_PENDING are waiting
+MULTIPART_MAX_PENDING = 64
+MULTIPART_MAX_AGE = 5  # Seconds
+
+# How often UDP mux channels re-resolve their destination host names
+RESOLVE_INTERVAL = 60  # Seconds
+
+# UDP input.  Datagrams are read into a preallocated buffer of UDP_BUFFER_SIZE,
+# at most UDP_DRAIN_BATCH per wakeup so a burst can't starve the heartbeat
+UDP_BUFFER_SIZE = 65535  # Bytes
+UDP_DRAIN_BATCH = 256
+UDP_STATS_INTERVAL = 60  # Seconds
+
+# Local (Unix socket) stream clients are dropped if this much output backs up
+UNIX_MAX_PENDING = 64 * 1024  # Bytes
+UNIX_STATS_INTERVAL = 60  # Seconds
+
+# How long stop() waits for a local (Unix socket/SHM) channel worker to clean up
+LOCAL_STOP_TIMEOUT = 2  # Seconds
+
+# Give up waiting for slow channels in the startup timing report after this
+STARTUP_REPORT_TIMEOUT = 30  # Seconds
+
+# Channel supervisor.  Failed channels are retried after SUPERVISOR_INITIAL_BACKOFF
+# seconds, doubling on each failed attempt up to cfg.SUPERVISOR_MAX_BACKOFF.
+SUPERVISOR_CHECK_INTERVAL = 1  # Seconds
+SUPERVISOR_INITIAL_BACKOFF = 1  # Seconds
+
 
-class TCPServer(socketserver.TCPServer):
+def lazy_import(name):
+    """Import a module on first use and record how long the import took"""
+    start_ts = time.perf_counter()
+    module = importlib.import_module(name)
+    IMPORT_TIMES[name] = time.perf_counter() - start_ts
+    return module
+
+
+def load_ais_decoder():
+    """Import pyais.  Until this completes parse_message passes everything through"""
+    global pyais  # pylint: disable=global-statement,invalid-name
+    pyais = lazy_import("pyais")
+    AIS_DECODER_READY.set()
+    LOGGER.info("AIS decoder ready")
+
+
+class ChannelStatus:
+    """Mixin to track when a channel is ready to pass data and whether it is still running"""
+    def init_status(self):
+        """Call from the channel __init__ before anything can fail"""
+        self.ready = threading.Event()
+        self.ready_ts = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.heartbeat = None
+
+    def is_alive(self):
+        """True while the channel worker thread is running"""
+        return self.thread is not None and self.thread.is_alive() and not self.stopping.is_set()
+
+    def set_ready(self):
+        """Mark the channel as listening/open.  The worker loop must beat from now on"""
+        self.heartbeat = heartbeat.register(self.name)
+        self.ready_ts = time.perf_counter()
+        self.ready.set()
+
+    def is_stalled(self, timeout):
+        """True if the worker loop has not beaten its heartbeat within timeout seconds"""
+        return self.heartbeat is not None and self.heartbeat.active and self.heartbeat.age() > timeout
+
+
+class TCPServer(ChannelStatus, socketserver.TCPServer):
     """TCP Server socket.  Use is_mux to set the server as a multiplexer or not.
     is_mux = False for input channel
     is_mux = True for output(mux) channel
     """
-    def __init__(self, server_address, tcp_handler, channel_name, is_mux=False):
+    # A restarted channel must be able to rebind while the old connection lingers
+    allow_reuse_address = True
+
+    def __init__(self, server_address, tcp_handler, channel_name, is_mux=False, decimate_interval=None):
         """Initialise the handler
         We default to an input channel set is_mux to True for a mux/output channel
         """
@@ -75,18 +212,41 @@ class TCPServer(socketserver.TCPServer):
         self.name = channel_name
         self.address = server_address
         self.is_mux = is_mux
+        self.decimator = Decimator(decimate_interval) if decimate_interval else None
+        self.client = None
+        self.init_status()
         super().__init__(server_address, tcp_handler)
+        self.set_ready()
         self.start_thread()
 
+    def service_actions(self):
+        """Called by serve_forever each poll while no client is connected"""
+        self.heartbeat.beat()
+
     def start_thread(self):
         """Start a thread to operate this socket"""
-        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread = threading.Thread(target=self.serve_forever, name=self.name)
         # Exit the server thread when the main thread terminates
         server_thread.daemon = True
         LOGGER.debug("Starting TCP Server: %s, %s, mux=%s", self.name, self.address, self.is_mux)
         server_thread.start()
+        self.thread = server_thread
         return server_thread
 
+    def stop(self):
+        """Stop serving and close the sockets.
+        Shutting down the client socket unblocks a handler stuck in send or recv.
+        """
+        self.stopping.set()
+        if self.client:
+            try:
+                self.client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.thread and self.thread.is_alive():
+            self.shutdown()
+        self.server_close()
+
 
 class TCPHandler(socketserver.BaseRequestHandler):
     """TCP Socket Handler
@@ -95,22 +255,33 @@ class TCPHandler(socketserver.BaseRequestHandler):
     def handle(self):
         """Handle the incoming request"""
         LOGGER.info("%s, Connection from: %s", self.server.name, self.client_address[0])
+        self.server.client = self.request
+        if not self.server.is_mux:
+            # Time out reads so an idle input client does not look like a stalled loop
+            self.request.settimeout(1)
 
-        while True:
+        while not STOP_THREADS.is_set() and not self.server.stopping.is_set():
+            self.server.heartbeat.beat()
             if self.server.is_mux:
-                data = self.server.mux_queue.get()
+                try:
+                    data = self.server.mux_queue.get(timeout=1)
+                except Empty:
+                    continue
                 LOGGER.debug("%s: Sending to: %s: %s", self.server.name, self.client_address[0], data)
                 try:
                     self.request.sendall(data)
-                except BrokenPipeError:
+                except OSError:
                     LOGGER.error("%s: Connection from %s closed", self.server.name, self.client_address[0])
                     break
 
             else:
                 try:
                     data = self.request.recv(1024)
-                except BrokenPipeError:
+                except socket.timeout:
+                    continue
+                except OSError:
                     LOGGER.error("%s: Connection from %s closed", self.server.name, self.client_address[0])
+                    break
 
                 if not data:
                     break
@@ -124,7 +295,7 @@ class TCPHandler(socketserver.BaseRequestHandler):
 
                 # Only put data on the queue if it is not full
                 if not DATA_QUEUE.full():
-                    DATA_QUEUE.put(data)
+                    DATA_QUEUE.put((self.server.name, data))
                 else:
                     LOGGER.error("DATA_QUEUE is full")
 
@@ -133,46 +304,108 @@ class TCPHandler(socketserver.BaseRequestHandler):
     def finish(self):
         """Finish the request"""
         LOGGER.info("Finished request from: %s", self.client_address[0])
+        self.server.client = None
         self.request.close()
 
 
-class UDPServer(socketserver.UDPServer):
-    """UDP Server socket"""
-    def __init__(self, server_address, udp_handler, channel_name, is_mux=False, send_to=None):
+class UDPServer(ChannelStatus, socketserver.UDPServer):
+    """UDP Server socket
+
+    As a mux channel we send to every address in send_to (a single (host, port) tuple
+    or a list of them) and to the optional multicast group.  Host names are resolved
+    once at startup and again every RESOLVE_INTERVAL, never per packet.
+    """
+    def __init__(
+        self, server_address, udp_handler, channel_name, is_mux=False, send_to=None, decimate_interval=None,
+        multicast=None, multicast_ttl=1
+    ):
         self.mux_queue = Queue(maxsize=MAX_Q_SIZE)
         self.name = channel_name
         self.address = server_address
         self.is_mux = is_mux
-        self.send_to = send_to
+        if isinstance(send_to, tuple):
+            send_to = [send_to]
+        self.send_to = list(send_to or [])
+        self.multicast = multicast
+        if multicast:
+            self.send_to.append(multicast)
+        self.destinations = []
+        self.last_resolve_ts = 0
+        self.decimator = Decimator(decimate_interval) if decimate_interval else None
+        self.init_status()
         super().__init__(server_address, udp_handler)
+        if multicast:
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+        if self.is_mux:
+            self.resolve_destinations()
+        self.set_ready()
         self.start_thread()
 
+    def resolve_destinations(self):
+        """Resolve send_to host names to IP addresses.
+        If a name fails to resolve we keep its last known address (if any) so a
+        DNS hiccup does not stop us sending to a device we could reach before.
+        """
+        self.last_resolve_ts = time.time()
+        previous = dict(zip(self.send_to, self.destinations)) if len(self.destinations) == len(self.send_to) else {}
+        destinations = []
+        for host, port in self.send_to:
+            try:
+                addr_info = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)
+                destinations.append(addr_info[0][4])
+            except OSError as err:
+                LOGGER.error("%s: Unable to resolve %s: %s", self.name, host, err)
+                destinations.append(previous.get((host, port)))
+
+        self.destinations = destinations
+        LOGGER.debug("%s: Sending to %s", self.name, self.destinations)
+
+    def resolve_if_due(self):
+        """Re-resolve the destinations every RESOLVE_INTERVAL"""
+        if time.time() - self.last_resolve_ts > RESOLVE_INTERVAL:
+            self.resolve_destinations()
+
     def service_actions(self):
         """If this is a mux channel then send any messages in the mux_queue to the socket
         If not mux (i.e. an input channel) then we handle incomming messages in the UDP handler
         """
+        self.heartbeat.beat()
+        if self.is_mux:
+            self.resolve_if_due()
+
         while self.is_mux and not self.mux_queue.empty():
             data = self.mux_queue.get()
-            LOGGER.debug("%s:Sending to: %s: %s", self.name, self.send_to, data)
-            try:
-                # self.socket.sendto(data, self.address)
-                # self.socket.sendto(data, ("0.0.0.0", 10110))
-                # self.socket.sendto(data, ("192.168.240.226", 10110))
-                self.socket.sendto(data, self.send_to)
-            except (BrokenPipeError, OSError) as err:
-                LOGGER.error("%s: Connection error = %s", self.name, err)
-                break
+            self.heartbeat.beat()
+            # A steady inflow can keep us in this loop indefinitely
+            self.resolve_if_due()
+            LOGGER.debug("%s:Sending to: %s: %s", self.name, self.destinations, data)
+            for dest in self.destinations:
+                if dest is None:
+                    continue
+                try:
+                    self.socket.sendto(data, dest)
+                except OSError as err:
+                    # One unreachable device must not stop the others getting data
+                    LOGGER.error("%s: Connection error to %s = %s", self.name, dest, err)
             time.sleep(0.01)
 
     def start_thread(self):
         """Start a thread to operate this socket"""
-        server_thread = threading.Thread(target=self.serve_forever)
+        server_thread = threading.Thread(target=self.serve_forever, name=self.name)
         # Exit the server thread when the main thread terminates
         server_thread.daemon = True
         LOGGER.debug("Starting UDP Server: %s, %s, mux=%s", self.name, self.address, self.is_mux)
         server_thread.start()
+        self.thread = server_thread
         return server_thread
 
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.stopping.set()
+        if self.thread and self.thread.is_alive():
+            self.shutdown()
+        self.server_close()
+
 
 class UDPHandler(socketserver.BaseRequestHandler):
     """
@@ -187,17 +420,136 @@ class UDPHandler(socketserver.BaseRequestHandler):
             sock = self.request[1]
             LOGGER.debug("%s: Connection from: %s. %s %s", self.server.name, self.client_address[0], data, sock)
             if not DATA_QUEUE.full():
-                DATA_QUEUE.put(data)
+                DATA_QUEUE.put((self.server.name, data))
+
 
+def udp_kernel_drops(sock):
+    """Datagrams the kernel dropped for this socket (receive buffer full).
+    Linux only, from the drops column of /proc/net/udp.  None if not available.
+    """
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for path in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(path, mode="r", encoding="utf-8") as file:
+                for line in file:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[12])
+        except OSError:
+            return None
+    return None
 
-class UARTServer:
+
+class UDPInput(ChannelStatus):
+    """UDP input channel.
+
+    Each time the socket is readable we drain up to UDP_DRAIN_BATCH pending
+    datagrams with recv_into() into one preallocated buffer, so there is no per
+    datagram object or thread hand off.  Datagrams holding several sentences are split into
+    individual sentences.  rcvbuf sets SO_RCVBUF so bursts from several gateways
+    don't overflow the kernel buffer, and kernel drops are logged every
+    UDP_STATS_INTERVAL where Linux reports them.
+    """
+    def __init__(self, server_address, channel_name, rcvbuf=None):
+        self.name = channel_name
+        self.address = server_address
+        self.is_mux = False
+        self.decimator = None
+        self.buffer = bytearray(UDP_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.datagrams = 0
+        self.sentences = 0
+        self.queue_drops = 0
+        self.kernel_drops = 0
+        self.init_status()
+        self.socket = self.open_socket(rcvbuf)
+        self.set_ready()
+        self.start_thread()
+
+    def open_socket(self, rcvbuf):
+        """Bind a non-blocking UDP socket"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        sock.bind(self.address)
+        sock.setblocking(False)
+        LOGGER.info(
+            "%s: Listening on %s, SO_RCVBUF=%s", self.name, self.address,
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        )
+        return sock
+
+    def drain(self, max_datagrams=UDP_DRAIN_BATCH):
+        """Read up to max_datagrams pending datagrams and queue their sentences.
+        Anything left is read on the next pass, after the heartbeat and stats.
+        """
+        for _ in range(max_datagrams):
+            try:
+                nbytes = self.socket.recv_into(self.buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            self.datagrams += 1
+            for sentence in self.view[:nbytes].tobytes().splitlines():
+                sentence = sentence.strip()
+                if not sentence:
+                    continue
+                self.sentences += 1
+                if not DATA_QUEUE.full():
+                    DATA_QUEUE.put((self.name, sentence))
+                else:
+                    self.queue_drops += 1
+
+    def log_stats(self):
+        """Log counters and any new kernel drops"""
+        drops = udp_kernel_drops(self.socket)
+        if drops is not None and drops > self.kernel_drops:
+            LOGGER.warning("%s: Kernel dropped %s datagrams", self.name, drops - self.kernel_drops)
+            self.kernel_drops = drops
+        LOGGER.info(
+            "%s: datagrams=%s sentences=%s queue_drops=%s kernel_drops=%s",
+            self.name, self.datagrams, self.sentences, self.queue_drops, drops
+        )
+
+    def udp_worker(self):
+        """Wait for the socket to be readable then drain it"""
+        LOGGER.debug("Starting UDP input on %s", self.address)
+        last_stats_ts = time.time()
+        while not STOP_THREADS.is_set() and not self.stopping.is_set():
+            self.heartbeat.beat()
+            readable, _, _ = select.select([self.socket], [], [], 1)
+            if readable:
+                self.drain()
+            if time.time() - last_stats_ts > UDP_STATS_INTERVAL:
+                last_stats_ts = time.time()
+                self.log_stats()
+
+        self.socket.close()
+        LOGGER.debug("Exiting UDP input thread for %s", self.address)
+
+    def start_thread(self):
+        """Start the worker thread"""
+        udp_thread = threading.Thread(target=self.udp_worker, name=self.name, daemon=True)
+        udp_thread.start()
+        THREAD_POOL.append(udp_thread)
+        self.thread = udp_thread
+
+    def stop(self):
+        """Ask the worker to exit.  It closes the socket on the way out"""
+        self.stopping.set()
+
+
+class UARTServer(ChannelStatus):
     """Class to handle UART serial connections"""
-    def __init__(self, port, baud, channel_name, is_mux=False):
+    def __init__(self, port, baud, channel_name, is_mux=False, decimate_interval=None):
         self.name = channel_name
         self.port = port
         self.baud = baud
         self.is_mux = is_mux
         self.mux_queue = Queue(maxsize=MAX_Q_SIZE)
+        self.decimator = Decimator(decimate_interval) if decimate_interval else None
+        self.serial = None
+        self.init_status()
         self.start_thread()
 
     def open_serial_port(self):
@@ -211,13 +563,18 @@ class UARTServer:
         return ser
 
     def serial_port_worker(self):
-        """Listen for data on a serial port and send it to any mux channels"""
+        """Listen for data on a serial port and send it to any mux channels
+        On a port error the thread exits and the ChannelSupervisor reopens the port.
+        """
         LOGGER.debug("Starting serial port on %s", self.port)
         ser = self.open_serial_port()
         if not ser:
             return
+        self.serial = ser
+        self.set_ready()
 
-        while not STOP_THREADS.is_set():
+        while not STOP_THREADS.is_set() and not self.stopping.is_set():
+            self.heartbeat.beat()
 
             if self.is_mux:
                 # Read any messages on mux queue and send those to the serial port
@@ -225,19 +582,23 @@ class UARTServer:
                     data = self.mux_queue.get()
                     if data:
                         LOGGER.debug("Sending to Serial MUX: %s, %s", self.port, data)
-                        ser.write(data + b"\r")
+                        try:
+                            ser.write(data + b"\r")
+                        except (serial.SerialException, OSError) as err:
+                            LOGGER.error("Serial port error %s: %s", self.port, err)
+                            break
 
             else:
                 # Read from the port and put messages onto the mux queue
                 try:
                     data = ser.readline().strip()
-                except serial.SerialException as err:
+                except (serial.SerialException, OSError) as err:
                     LOGGER.error("Serial port error %s: %s", self.port, err)
-                    STOP_THREADS.set()
+                    break
                 else:
                     LOGGER.debug("Serial Data: %s", data)
                     if data and not DATA_QUEUE.full():
-                        DATA_QUEUE.put(data)
+                        DATA_QUEUE.put((self.name, data))
 
             time.sleep(0.01)
 
@@ -253,140 +614,943 @@ class UARTServer:
         ser_thread.start()
         ser_thread.name = self.name
         THREAD_POOL.append(ser_thread)
+        self.thread = ser_thread
+
+    def stop(self):
+        """Ask the worker to exit.  It closes the port within one readline timeout.
+        Cancelling any blocked read or write frees a worker that has stalled on the port.
+        """
+        self.stopping.set()
+        if self.serial is not None and hasattr(self.serial, "cancel_write"):
+            try:
+                self.serial.cancel_write()
+                self.serial.cancel_read()
+            except (serial.SerialException, OSError):
+                pass
+
+
+def join_worker(thread, timeout=LOCAL_STOP_TIMEOUT):
+    """Wait for a channel worker thread to exit, unless it is this thread"""
+    if thread is not None and thread is not threading.current_thread():
+        thread.join(timeout)
+        if thread.is_alive():
+            LOGGER.warning("%s: Worker did not exit within %ss", thread.name, timeout)
+
+
+def drain_queue(mux_queue, timeout):
+    """Wait up to timeout for data then return everything on the queue"""
+    try:
+        items = [mux_queue.get(timeout=timeout)]
+    except Empty:
+        return []
+    while True:
+        try:
+            items.append(mux_queue.get_nowait())
+        except Empty:
+            return items
+
+
+class UnixServer(ChannelStatus):
+    """Unix domain socket mux channel for consumers on the same machine.
+
+    socket_type "stream": we listen on path and send to every connected client.
+    Queued sentences are joined and sent with one send per client.  Sockets are
+    non-blocking and a client that falls more than UNIX_MAX_PENDING behind is
+    disconnected, so a slow reader never holds up the mux.
+
+    socket_type "dgram": each sentence is sent as a datagram to every path in
+    send_to (sockets bound by the consumers).  If a consumer's receive queue is
+    full the datagram is dropped.  Drops and slow clients are logged every
+    UNIX_STATS_INTERVAL.
+    """
+    def __init__(self, path, channel_name, socket_type="stream", send_to=None, decimate_interval=None):
+        self.name = channel_name
+        self.path = path
+        self.socket_type = socket_type
+        self.send_to = list(send_to or [])
+        self.is_mux = True
+        self.mux_queue = Queue(maxsize=MAX_Q_SIZE)
+        self.decimator = Decimator(decimate_interval) if decimate_interval else None
+        self.clients = {}
+        self.sent = 0
+        self.dropped = 0
+        self.slow_clients = 0
+        self.logged_drops = 0
+        self.inode = None
+        self.init_status()
+        self.socket = self.open_socket()
+        self.set_ready()
+        self.start_thread()
+
+    def open_socket(self):
+        """Create the socket.  For a stream socket we bind and listen on path"""
+        if self.socket_type == "stream":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            if os.path.lexists(self.path):
+                # Only replace a socket left behind, never a file the config points at by mistake
+                if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                    sock.close()
+                    raise FileExistsError(f"{self.path} exists and is not a socket")
+                os.unlink(self.path)
+            sock.bind(self.path)
+            sock.listen(5)
+            # A restarted channel binds a new socket at the same path
+            self.inode = os.stat(self.path).st_ino
+        elif self.socket_type == "dgram":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            raise ValueError(f"Unknown Unix socket type: {self.socket_type}")
+        sock.setblocking(False)
+        return sock
+
+    def accept_clients(self):
+        """Accept any new stream connections"""
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except BlockingIOError:
+                return
+            conn.setblocking(False)
+            self.clients[conn] = bytearray()
+            LOGGER.info("%s: Local client connected", self.name)
+
+    def close_client(self, conn, reason):
+        """Disconnect a stream client"""
+        LOGGER.info("%s: Closing local client: %s", self.name, reason)
+        del self.clients[conn]
+        conn.close()
+
+    def send_stream(self, items):
+        """Send the queued sentences to every stream client"""
+        data = b"".join(item if item.endswith(b"\n") else item + b"\r\n" for item in items)
+        for conn, pending in list(self.clients.items()):
+            pending += data
+            try:
+                sent = conn.send(pending)
+            except BlockingIOError:
+                sent = 0
+            except OSError as err:
+                self.close_client(conn, err)
+                continue
+            del pending[:sent]
+            if len(pending) > UNIX_MAX_PENDING:
+                self.slow_clients += 1
+                self.close_client(conn, "too slow")
+
+    def send_dgram(self, items):
+        """Send each sentence as a datagram to every consumer"""
+        for data in items:
+            for path in self.send_to:
+                try:
+                    self.socket.sendto(data, path)
+                except BlockingIOError:
+                    self.dropped += 1
+                except (FileNotFoundError, ConnectionRefusedError):
+                    # Consumer not running
+                    pass
+                except OSError as err:
+                    LOGGER.error("%s: Error sending to %s: %s", self.name, path, err)
+
+    def log_stats(self):
+        """Log counters and any new dropped datagrams"""
+        if self.dropped > self.logged_drops:
+            LOGGER.warning(
+                "%s: Dropped %s datagrams, consumer not keeping up", self.name, self.dropped - self.logged_drops
+            )
+            self.logged_drops = self.dropped
+        LOGGER.info(
+            "%s: sent=%s clients=%s dropped=%s slow_clients=%s",
+            self.name, self.sent, len(self.clients), self.dropped, self.slow_clients
+        )
+
+    def unix_worker(self):
+        """Send anything on the mux queue to the local consumers"""
+        LOGGER.debug("Starting Unix %s socket %s", self.socket_type, self.path)
+        last_stats_ts = time.time()
+        while not STOP_THREADS.is_set() and not self.stopping.is_set():
+            self.heartbeat.beat()
+            if time.time() - last_stats_ts > UNIX_STATS_INTERVAL:
+                last_stats_ts = time.time()
+                self.log_stats()
+            if self.socket_type == "stream":
+                self.accept_clients()
+            items = drain_queue(self.mux_queue, timeout=0.1)
+            if not items:
+                continue
+            self.sent += len(items)
+            if self.socket_type == "stream":
+                self.send_stream(items)
+            else:
+                self.send_dgram(items)
+
+        for conn in list(self.clients):
+            self.close_client(conn, "channel stopped")
+        self.socket.close()
+        if self.socket_type == "stream" and self.owns_path():
+            os.unlink(self.path)
+        LOGGER.debug("Exiting Unix socket thread for %s", self.path)
+
+    def owns_path(self):
+        """True if path is still our socket and not one bound by a replacement channel"""
+        try:
+            return os.stat(self.path).st_ino == self.inode
+        except FileNotFoundError:
+            return False
+
+    def start_thread(self):
+        """Start the worker thread"""
+        unix_thread = threading.Thread(target=self.unix_worker, name=self.name, daemon=True)
+        unix_thread.start()
+        THREAD_POOL.append(unix_thread)
+        self.thread = unix_thread
+
+    def stop(self):
+        """Ask the worker to exit and wait for it to close the socket"""
+        self.stopping.set()
+        join_worker(self.thread)
+
+
+class ShmRingServer(ChannelStatus):
+    """Shared memory mux channel.
+    Each sentence is appended to a shm_ring.RingWriter.  Local readers map the
+    ring by name and follow the sequence counter (see shm_ring.RingReader).  The
+    writer never waits so a slow reader can never back-pressure the mux.
+    """
+    def __init__(self, shm_name, channel_name, capacity=None, decimate_interval=None):
+        self.name = channel_name
+        self.shm_name = shm_name
+        self.is_mux = True
+        self.mux_queue = Queue(maxsize=MAX_Q_SIZE)
+        self.decimator = Decimator(decimate_interval) if decimate_interval else None
+        self.init_status()
+        shm_ring = lazy_import("shm_ring")
+        self.ring = shm_ring.RingWriter(shm_name, capacity or shm_ring.DEFAULT_CAPACITY)
+        self.set_ready()
+        self.start_thread()
+
+    def shm_worker(self):
+        """Copy the mux queue into the ring"""
+        LOGGER.debug("Starting shared memory ring %s", self.shm_name)
+        while not STOP_THREADS.is_set() and not self.stopping.is_set():
+            self.heartbeat.beat()
+            for data in drain_queue(self.mux_queue, timeout=0.1):
+                try:
+                    self.ring.write(data)
+                except ValueError as err:
+                    LOGGER.error("%s: %s", self.name, err)
+        self.ring.close()
+        LOGGER.debug("Exiting shared memory ring thread for %s", self.shm_name)
+
+    def start_thread(self):
+        """Start the worker thread"""
+        shm_thread = threading.Thread(target=self.shm_worker, name=self.name, daemon=True)
+        shm_thread.start()
+        THREAD_POOL.append(shm_thread)
+        self.thread = shm_thread
+
+    def stop(self):
+        """Ask the worker to exit and wait for it to close the ring"""
+        self.stopping.set()
+        join_worker(self.thread)
 
 
 class MMSIcache:
-    """Class to handle the MMSI Cache"""
+    """Class to handle the MMSI Cache.
+    Each vessel holds the attributes the AIS rules look at (None until heard) and
+    the cached rules verdict, which is cleared whenever an attribute changes.
+    """
     def __init__(self) -> None:
         self.cache = {}
 
-    def update_vessel(self, mmsi, length=None):
-        """Add or update a vessel in the cache"""
-        if mmsi in self.cache:
-            # Update the vessel
-            if length:
-                self.cache[mmsi] = {"length": length, "timestamp": time.time()}
-            else:
-                self.cache[mmsi]["timestamp"] = time.time()
-        else:
-            self.cache[mmsi] = {"length": length, "timestamp": time.time()}
+    def update_vessel(self, mmsi, length=None, ship_type=None, msg_type=None):
+        """Add or update a vessel in the cache and return it"""
+        if mmsi is None:
+            return None
+
+        vessel = self.cache.get(mmsi)
+        if vessel is None:
+            vessel = self.cache[mmsi] = {
+                "mmsi": mmsi,
+                "mid": ais_rules.mid_of(mmsi),
+                "type": None,
+                "class": None,
+                "length": None,
+                "timestamp": 0,
+                "verdict": None,
+            }
+
+        vessel_class = ais_rules.vessel_class(msg_type)
+        for key, value in (("length", length), ("type", ship_type), ("class", vessel_class)):
+            if value is not None and value != vessel[key]:
+                vessel[key] = value
+                vessel["verdict"] = None
+        vessel["timestamp"] = time.time()
+        return vessel
 
     def purge(self, delete_age=60*60):
-        """Delete vessels if they have to been heard recently
+        """Delete vessels if they have not been heard recently
         delete_age = time in seconds.
         If last message is older then delete this device.  Default is 1hr
         """
-        self.cache = {k: v for k, v in self.cache.items() if v["timestamp"] < time.time() - delete_age}
+        self.cache = {k: v for k, v in self.cache.items() if v["timestamp"] >= time.time() - delete_age}
+
+
+class Decimator:
+    """Forward at most one position report per vessel per interval.
+
+    Send times are kept in two time buckets, each covering one interval.  When the
+    current bucket expires it becomes the previous bucket and the old previous bucket
+    is dropped wholesale, so lookups are O(1) and we never have to scan for stale
+    vessels.  Both buckets together hold at most max_vessels.  Each bucket is kept
+    in send order so when we are full the vessel sent longest ago is evicted first.
+    """
+    def __init__(self, interval, max_vessels=DECIMATE_MAX_VESSELS):
+        self.interval = interval
+        self.max_vessels = max_vessels
+        self.bucket_start = time.time()
+        self.current = {}
+        self.previous = {}
+        self.evictions = 0
+
+    def rotate(self, now):
+        """Start a new bucket, dropping everything older than the previous bucket"""
+        if self.evictions:
+            LOGGER.warning(
+                "Decimator full (%s vessels), evicted %s.  Some vessels were not decimated",
+                self.max_vessels, self.evictions
+            )
+            self.evictions = 0
+        if now - self.bucket_start >= 2 * self.interval:
+            self.previous = {}
+        else:
+            self.previous = self.current
+        self.current = {}
+        self.bucket_start = now
+
+    def evict_oldest(self):
+        """Forget the vessel we sent longest ago"""
+        bucket = self.previous or self.current
+        del bucket[next(iter(bucket))]
+        self.evictions += 1
+
+    def allow(self, mmsi, msg_type, now=None):
+        """Return True if this message should be forwarded"""
+        if mmsi is None or msg_type not in DECIMATE_MSG_TYPES:
+            return True
+
+        now = now or time.time()
+        if now - self.bucket_start >= self.interval:
+            self.rotate(now)
+
+        last_sent = self.current.get(mmsi) or self.previous.get(mmsi)
+        if last_sent and now - last_sent < self.interval:
+            return False
 
+        # Move the vessel to the end of the current bucket
+        self.previous.pop(mmsi, None)
+        self.current.pop(mmsi, None)
+        if len(self.current) + len(self.previous) >= self.max_vessels:
+            self.evict_oldest()
+        self.current[mmsi] = now
+        return True
 
-def parse_message(data):
-    """Parse mmsi and length from the message"""
+
+class MultipartAssembler:
+    """Collect the sentences of multipart AIS messages.
+
+    Sentences are keyed on (source channel, sequential message id, total) so
+    messages interleaved on different channels or inputs don't get mixed up.  A
+    sentence out of order or without the ones before it can't be completed and
+    is dropped.
+    """
+    def __init__(self, max_pending=MULTIPART_MAX_PENDING, max_age=MULTIPART_MAX_AGE):
+        self.max_pending = max_pending
+        self.max_age = max_age
+        # key: (first sentence timestamp, sentences so far), oldest first
+        self.pending = OrderedDict()
+        self.dropped = 0
+
+    def drop(self, key, reason):
+        """Forget an incomplete message"""
+        LOGGER.debug("Dropping multipart message %s: %s", key, reason)
+        self.pending.pop(key, None)
+        self.dropped += 1
+
+    def add(self, source, data, now=None):
+        """Add a sentence.  Returns the list of sentences in the message once it
+        is complete, or None while we wait for the rest.  Anything that isn't a
+        multipart AIS sentence is returned as is.
+        """
+        fields = data.split(b",", 4)
+        if not data.startswith(b"!AIVDM") or len(fields) < 5 or fields[1] == b"1":
+            return [data]
+        if not fields[1].isdigit() or not fields[2].isdigit():
+            return [data]
+
+        now = now or time.time()
+        while self.pending:
+            key, (first_ts, _parts) = next(iter(self.pending.items()))
+            if now - first_ts <= self.max_age:
+                break
+            self.drop(key, "timed out")
+
+        key = (source, fields[3], fields[1])
+        number = int(fields[2])
+        if number == 1:
+            if key in self.pending:
+                self.drop(key, "restarted")
+            self.pending[key] = (now, [data])
+            if len(self.pending) > self.max_pending:
+                self.drop(next(iter(self.pending)), "too many pending")
+            return None
+
+        entry = self.pending.get(key)
+        if entry is None or len(entry[1]) != number - 1:
+            self.drop(key, f"sentence {number} out of order")
+            return None
+        entry[1].append(data)
+        if number == int(fields[1]):
+            del self.pending[key]
+            return entry[1]
+        return None
+
+
+class DecodeCache:
+    """LRU cache of decode results keyed on the AIS payload.
+
+    Static reports, AtoNs, base stations and repeated messages arrive byte for byte
+    the same, so a hit costs a dict lookup instead of a pyais decode.  The payload
+    is used as the key (not the whole sentence) so the same message heard on
+    channel A and B hits too, whatever sequential message id a multipart message
+    was sent with.  Multipart messages are keyed on their joined payloads.  Each
+    entry is roughly 200 bytes.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached result or None"""
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        """Add a result, evicting the least recently used if we are full"""
+        self.entries[key] = result
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """Counters for logging"""
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def decode_ais(*parts):
+    """Decode an AIS message (one or more sentences) with pyais and extract mmsi,
+    length, message type and ship type.
+    A length or ship type of 0 means not available and is returned as None.
+    """
     mmsi = None
     ship_length = None
-    if data.startswith(b"!AIVDM"):
-        LOGGER.debug("ATTEMPTING DECODE...")
-        try:
-            ais = pyais.decode(data).asdict()
-            LOGGER.debug("AIS: %s", ais)
-
-            if "mmsi" in ais:
-                # Get the ship length
-                mmsi = ais["mmsi"]
-                to_bow = ais.get("to_bow", 0)
-                to_stern = ais.get("to_stern", 0)
-                ship_length = to_bow + to_stern
-
-        except (
-            pyais.exceptions.UnknownMessageException,
-            pyais.exceptions.MissingMultipartMessageException
+    msg_type = None
+    ship_type = None
+    LOGGER.debug("ATTEMPTING DECODE...")
+    try:
+        ais = pyais.decode(*parts).asdict()
+        LOGGER.debug("AIS: %s", ais)
+
+        if "mmsi" in ais:
+            # Get the ship length
+            mmsi = ais["mmsi"]
+            msg_type = ais.get("msg_type")
+            to_bow = ais.get("to_bow", 0)
+            to_stern = ais.get("to_stern", 0)
+            ship_length = (to_bow + to_stern) or None
+            ship_type = int(ais.get("ship_type") or 0) or None
+
+    except pyais.exceptions.AISBaseException as err:
+        # Corrupt or truncated sentences from the VHF must not stop the mux
+        LOGGER.debug("Unable to decode %s: %s", parts, err)
+    return mmsi, ship_length, msg_type, ship_type
+
+
+def parse_message(*parts, decode_cache=None):
+    """Parse mmsi, length, message type and ship type from the message, given
+    all of its sentences in order.  Results are looked up in decode_cache (if
+    given) first.
+    """
+    if pyais is None:
+        return None, None, None, None
+
+    total = str(len(parts)).encode()
+    payloads = []
+    for number, data in enumerate(parts, 1):
+        fields = data.split(b",")
+        if (
+            not data.startswith(b"!AIVDM") or len(fields) < 7
+            or fields[1] != total or fields[2] != str(number).encode()
         ):
-            pass
-    return mmsi, ship_length
+            # Not AIS, or an incomplete multipart message which can't be decoded
+            return None, None, None, None
+        payloads.append(fields[5])
+    if decode_cache is None:
+        return decode_ais(*parts)
+
+    # Payload(s) and the fill bits of the last sentence
+    key = b"".join(payloads) + b"," + fields[6][:1]
+    result = decode_cache.get(key)
+    if result is None:
+        result = decode_ais(*parts)
+        decode_cache.put(key, result)
+    return result
+
+
+def reject_ais(mmsi, mmsi_cache, rules):
+    """Returns true if the message is one we want to filter out.
+    The rules are only evaluated when the vessel's cached attributes have changed.
+    """
+    if mmsi is None:
+        return False
+    vessel = mmsi_cache.cache.get(mmsi) or mmsi_cache.update_vessel(mmsi)
+    verdict = vessel["verdict"]
+    if verdict is None:
+        verdict = vessel["verdict"] = rules.allows(vessel)
+    return not verdict
+
+
+class MuxState:
+    """State shared by the pipeline stages"""
+    def __init__(self, mmsi_cache, decode_cache, channels):
+        self.mmsi_cache = mmsi_cache
+        self.decode_cache = decode_cache
+        # Anything with a mux_chans list and a configs dict (channel name to
+        # config) e.g. ChannelSupervisor
+        self.channels = channels
+
+
+def queue_for_channel(channel, data):
+    """Put data on a mux channel queue unless it is full"""
+    if not channel.mux_queue.full():
+        channel.mux_queue.put(data)
+    else:
+        LOGGER.error("MUX_QUEUE is full: %s", channel.name)
+
+
+def nmea_checksum_ok(data):
+    """True if the sentence has no checksum or the checksum is correct"""
+    star = data.rfind(b"*")
+    if star < 0:
+        return True
+    checksum = 0
+    for byte in data[1:star]:
+        checksum ^= byte
+    try:
+        return checksum == int(data[star + 1:star + 3], 16)
+    except ValueError:
+        return False
 
 
-def reject_ais(mmsi, mmsi_cache, min_length):
-    """Returns true if the message is one we want to filter out
-    Reject messages from vessels for which we have no length
+@register_stage("validate")
+def validate_stage(_state):
+    """Drop sentences with a bad checksum.
+    Only use this if every input sends one sentence per message (TCP input may
+    deliver several sentences in one read).
     """
-    try:
-        LOGGER.info("Cache Length: %s", mmsi_cache[mmsi]["length"])
-        if mmsi_cache[mmsi]["length"] < min_length:
+    def validate(sentence):
+        if nmea_checksum_ok(sentence.data):
             return True
-
-    except (KeyError, TypeError) as err:
-        LOGGER.info("Exception: %s", err)
+        LOGGER.debug("Bad checksum: %s", sentence.data)
         return False
+    return validate
 
-    return False
 
+@register_stage("decode")
+def decode_stage(state):
+    """Extract mmsi, ship length, message type and ship type from AIS sentences.
+    The sentences of a multipart message are held until it is complete, then
+    decoded and passed on together as one item.
+    """
+    decode_cache = state.decode_cache
+    assembler = MultipartAssembler()
+
+    def decode(sentence):
+        parts = assembler.add(sentence.source, sentence.data)
+        if parts is None:
+            return False
+        if len(parts) > 1:
+            # The last sentence keeps its own line ending, as a single sentence would
+            sentence.data = b"".join(part.rstrip() + b"\r\n" for part in parts[:-1]) + parts[-1]
+            parts = [part.strip() for part in parts]
+        sentence.mmsi, sentence.ship_length, sentence.msg_type, sentence.ship_type = parse_message(
+            *parts, decode_cache=decode_cache
+        )
+        return True
+    return decode
+
+
+@register_stage("track")
+def track_stage(state):
+    """Update the MMSI cache with what we have learned about the vessel"""
+    mmsi_cache = state.mmsi_cache
+
+    def track(sentence):
+        mmsi_cache.update_vessel(
+            mmsi=sentence.mmsi, length=sentence.ship_length, ship_type=sentence.ship_type, msg_type=sentence.msg_type
+        )
+        return True
+    return track
+
+
+@register_stage("ais_filter")
+def ais_filter_stage(state):
+    """Drop AIS targets the rules in cfg.AIS_RULES deny"""
+    mmsi_cache = state.mmsi_cache
+    rules = ais_rules.AisRules(cfg.AIS_RULES, cfg.AIS_DEFAULT_ACTION)
+
+    def ais_filter(sentence):
+        if reject_ais(mmsi=sentence.mmsi, mmsi_cache=mmsi_cache, rules=rules):
+            LOGGER.debug("REJECTING: %s, %s", sentence.mmsi, sentence.ship_length)
+            return False
+        LOGGER.debug("ACCEPTING: %s, %s", sentence.mmsi, sentence.ship_length)
+        return True
+    return ais_filter
+
+
+@register_stage("route")
+def route_stage(state):
+    """Put the sentence on every live mux channel queue, subject to decimation"""
+    channels = state.channels
+
+    def route(sentence):
+        for channel in channels.mux_chans:
+            if channel.decimator and not channel.decimator.allow(sentence.mmsi, sentence.msg_type):
+                continue
+            queue_for_channel(channel, sentence.data)
+        return True
+    return route
+
+
+@register_stage("gps")
+def gps_stage(state):
+    """Pass on GPS position sentences from the best source only.
+    Channels with a gps_rate (Hz) get one consolidated set of position sentences
+    per 1/gps_rate seconds, the others get the selected source's sentences as is.
+    Position sentences are routed here and go no further down the pipeline.  Any
+    other sentence (GSV, ZDA, or APB/RMB from a plotter) carries on as normal.
+    """
+    fusion = gps_fusion.GpsFusion(max_age=cfg.GPS_MAX_AGE)
+    channels = state.channels
+    rates = {name: config.get("gps_rate") for name, config in channels.configs.items()}
+    last_emit_ts = {}
 
-def main():
-    """Entry point"""
+    def gps(sentence):
+        if not gps_fusion.is_position(sentence.data):
+            return True
 
-    mmsi_cache = MMSIcache()
+        now = time.time()
+        if not fusion.update(sentence.source, sentence.data, now):
+            return False
+
+        for channel in channels.mux_chans:
+            rate = rates.get(channel.name)
+            if not rate:
+                queue_for_channel(channel, sentence.data)
+            elif now - last_emit_ts.get(channel.name, 0) >= 1 / rate:
+                last_emit_ts[channel.name] = now
+                for data in fusion.consolidated():
+                    queue_for_channel(channel, data)
+        return False
+    return gps
+
+
+def create_channel(channel):
+    """Create and start a channel from its config dict"""
+    if channel["type"] == "TCP":
+        server = TCPServer(
+            channel["address"],
+            TCPHandler,
+            channel["name"],
+            is_mux=channel["is_mux"],
+            decimate_interval=channel.get("decimate_interval")
+        )
+    elif channel["type"] == "UDP" and not channel["is_mux"]:
+        server = UDPInput(
+            channel["address"],
+            channel["name"],
+            rcvbuf=channel.get("rcvbuf")
+        )
+    elif channel["type"] == "UDP":
+        server = UDPServer(
+            channel["address"],
+            UDPHandler,
+            channel["name"],
+            is_mux=channel["is_mux"],
+            send_to=channel.get("send_to"),
+            decimate_interval=channel.get("decimate_interval"),
+            multicast=channel.get("multicast"),
+            multicast_ttl=channel.get("multicast_ttl", 1)
+        )
+    elif channel["type"] == "SERIAL":
+        server = UARTServer(
+            port=channel["port"],
+            baud=channel["baud"],
+            channel_name=channel["name"],
+            is_mux=channel["is_mux"],
+            decimate_interval=channel.get("decimate_interval")
+        )
+    elif channel["type"] == "UNIX":
+        server = UnixServer(
+            path=channel.get("path"),
+            channel_name=channel["name"],
+            socket_type=channel.get("socket_type", "stream"),
+            send_to=channel.get("send_to"),
+            decimate_interval=channel.get("decimate_interval")
+        )
+    elif channel["type"] == "SHM":
+        server = ShmRingServer(
+            shm_name=channel["shm_name"],
+            channel_name=channel["name"],
+            capacity=channel.get("capacity"),
+            decimate_interval=channel.get("decimate_interval")
+        )
+    else:
+        raise ValueError(f"Unknown channel type: {channel['type']}")
+    return server
+
+
+CHANNEL_TYPES = ("TCP", "UDP", "SERIAL", "UNIX", "SHM")
+
+
+def backoff_delay(attempts, max_backoff):
+    """Seconds to wait before the next restart attempt"""
+    return min(SUPERVISOR_INITIAL_BACKOFF * 2 ** (attempts - 1), max_backoff)
+
+
+class ChannelSupervisor:
+    """Start the configured channels and restart any that fail.
+
+    Each channel is restarted on its own with exponential backoff, so the other
+    channels keep forwarding while it recovers.  A channel whose worker loop has
+    not beaten its heartbeat for cfg.HEARTBEAT_TIMEOUT counts as failed.  mux_chans is replaced (never
+    modified in place) so the main loop can read it without a lock.
+    """
+    def __init__(self, channel_configs, max_backoff=None):
+        self.configs = {}
+        for channel in channel_configs:
+            if channel["type"] not in CHANNEL_TYPES:
+                LOGGER.error("Unknown channel type: %s", channel["type"])
+                continue
+            self.configs[channel["name"]] = channel
+        self.max_backoff = max_backoff or cfg.SUPERVISOR_MAX_BACKOFF
+        self.channels = {}
+        self.mux_chans = []
+        self.incidents = {}
+
+    def start_channel(self, name):
+        """Create the named channel.  Returns None if it failed to start"""
+        try:
+            channel = create_channel(self.configs[name])
+        except OSError as err:
+            LOGGER.error("%s: Failed to start: %s", name, err)
+            self.channels.pop(name, None)
+            return None
+        self.channels[name] = channel
+        return channel
+
+    def start_all(self):
+        """Start all channels.  Any that fail are retried by check()"""
+        for name in self.configs:
+            self.start_channel(name)
+        self.update_mux_chans()
+        self.check()
+
+    def update_mux_chans(self):
+        """Rebuild the list of live output channels if it has changed.
+        A channel is only live once it is ready (e.g. its serial port is open).
+        """
+        mux_chans = [
+            chan for chan in self.channels.values() if chan.is_mux and chan.ready.is_set() and chan.is_alive()
+        ]
+        if mux_chans != self.mux_chans:
+            self.mux_chans = mux_chans
+
+    def check(self):
+        """Restart failed channels whose backoff has expired and log any recoveries"""
+        now = time.time()
+        for name in self.configs:
+            channel = self.channels.get(name)
+            incident = self.incidents.get(name)
+
+            healthy = channel is not None and channel.is_alive()
+            if healthy and channel.is_stalled(cfg.HEARTBEAT_TIMEOUT):
+                LOGGER.error("%s: Stalled, no heartbeat for %.1fs", name, channel.heartbeat.age())
+                healthy = False
+
+            if healthy:
+                if incident and channel.ready.is_set():
+                    LOGGER.warning(
+                        "%s: Recovered after %.1fs, %s restart attempts",
+                        name, now - incident["failed_ts"], incident["attempts"]
+                    )
+                    del self.incidents[name]
+                continue
+
+            # The supervisor owns this channel now.  Stop the watchdog waiting on it
+            if channel is not None and channel.heartbeat is not None:
+                channel.heartbeat.stop()
+
+            if incident is None:
+                LOGGER.error("%s: Channel failed", name)
+                incident = {"failed_ts": now, "attempts": 0, "retry_ts": now}
+                self.incidents[name] = incident
+
+            if now >= incident["retry_ts"]:
+                if channel is not None:
+                    channel.stop()
+                incident["attempts"] += 1
+                incident["retry_ts"] = now + backoff_delay(incident["attempts"], self.max_backoff)
+                LOGGER.info("%s: Restarting, attempt %s", name, incident["attempts"])
+                self.start_channel(name)
+
+        # Channels can die or become ready between restarts
+        self.update_mux_chans()
+
+    def run(self):
+        """Supervise the channels until STOP_THREADS is set"""
+        beat = heartbeat.register("Channel supervisor").beat
+        while not STOP_THREADS.wait(SUPERVISOR_CHECK_INTERVAL):
+            beat()
+            self.check()
 
-    channels = []
-    for channel in cfg.CHANNELS:
-        if channel["type"] == "TCP":
-            server = TCPServer(
-                channel["address"],
-                TCPHandler,
-                channel["name"],
-                is_mux=channel["is_mux"]
-            )
-        elif channel["type"] == "UDP":
-            server = UDPServer(
-                channel["address"],
-                UDPHandler,
-                channel["name"],
-                is_mux=channel["is_mux"],
-                send_to=channel["send_to"]
-            )
-        elif channel["type"] == "SERIAL":
-            server = UARTServer(
-                port=channel["port"],
-                baud=channel["baud"],
-                channel_name=channel["name"],
-                is_mux=channel["is_mux"]
-            )
+    def start_thread(self):
+        """Start the supervisor thread"""
+        sup_thread = threading.Thread(target=self.run, name="Channel supervisor", daemon=True)
+        sup_thread.start()
+        THREAD_POOL.append(sup_thread)
+        return sup_thread
+
+
+def install_profiling_signals():
+    """SIGUSR1 starts/stops a profile, SIGUSR2 dumps thread stacks.
+    The handlers only start a thread, so nothing that can fail (imports, file
+    I/O) runs in the signal handler and interrupts the main loop.  The
+    profiling module is only imported when first needed.
+    """
+    profiler = None
+    profiler_lock = threading.Lock()
+
+    def toggle_profile():
+        nonlocal profiler
+        with profiler_lock:
+            if profiler is None:
+                profiler = lazy_import("profiling").SamplingProfiler(cfg.PROFILE_DIR)
+            if profiler.running():
+                profiler.stop()
+            else:
+                profiler.start(cfg.PROFILE_DURATION)
+
+    def dump_stacks():
+        lazy_import("profiling").dump_stacks(cfg.PROFILE_DIR)
+
+    def in_thread(target):
+        def handler(_signum, _frame):
+            threading.Thread(target=target, name="Profiling signal", daemon=True).start()
+        return handler
+
+    signal.signal(signal.SIGUSR1, in_thread(toggle_profile))
+    signal.signal(signal.SIGUSR2, in_thread(dump_stacks))
+
+
+def report_startup(supervisor, start_ts, wait_for_decoder, timeout=STARTUP_REPORT_TIMEOUT):
+    """Log module import times and how long each channel took to become ready"""
+    deadline = time.perf_counter() + timeout
+    for name in supervisor.configs:
+        channel = supervisor.channels.get(name)
+        if channel is not None:
+            channel.ready.wait(max(0, deadline - time.perf_counter()))
+    if wait_for_decoder:
+        AIS_DECODER_READY.wait(max(0, deadline - time.perf_counter()))
+
+    for name, duration in IMPORT_TIMES.items():
+        LOGGER.info("Startup: imported %s in %.1f ms", name, duration * 1000)
+    for name in supervisor.configs:
+        channel = supervisor.channels.get(name)
+        if channel is None or channel.ready_ts is None:
+            LOGGER.warning("Startup: %s not ready after %ss", name, timeout)
         else:
-            LOGGER.error("Unknown channel type: %s", channel["type"])
-            continue
+            LOGGER.info("Startup: %s ready after %.1f ms", name, (channel.ready_ts - start_ts) * 1000)
+
 
-        THREAD_POOL.append(server)
-        channels.append(server)
+def purge_and_report(mmsi_cache, decode_cache, pipeline):
+    """Purge old vessels from the MMSI cache and log the cache and pipeline stats"""
+    LOGGER.info("MMSI_CACHE LEN: %s", len(mmsi_cache.cache))
+    mmsi_cache.purge(delete_age=60*60)
+    LOGGER.info("MMSI_CACHE PURGED. LEN: %s", len(mmsi_cache.cache))
+    LOGGER.info("DECODE_CACHE: %s", decode_cache.stats())
+    pipeline.report()
 
-    mux_chans = [chan for chan in channels if chan.is_mux]
+
+def main():
+    """Entry point"""
+    start_ts = time.perf_counter()
+
+    mmsi_cache = MMSIcache()
+    decode_cache = DecodeCache(cfg.DECODE_CACHE_ENTRIES)
+
+    install_profiling_signals()
+
+    supervisor = ChannelSupervisor(cfg.CHANNELS)
+    supervisor.start_all()
+    supervisor.start_thread()
+
+    # Channels are already passing data.  Load the decoder in the background if
+    # anything needs it, and filter once it is ready.
+    pipeline = Pipeline(cfg.PIPELINE_STAGES, MuxState(mmsi_cache, decode_cache, supervisor))
+    needs_decoder = "decode" in pipeline.names
+    if needs_decoder:
+        threading.Thread(target=load_ais_decoder, name="AIS decoder loader", daemon=True).start()
+    threading.Thread(
+        target=report_startup, args=(supervisor, start_ts, needs_decoder), name="Startup report", daemon=True
+    ).start()
+
+    heartbeat.Watchdog(
+        cfg.HEARTBEAT_TIMEOUT, heartbeat.watchdog_interval(cfg.WATCHDOG_INTERVAL), cfg.LOOP_REPORT_INTERVAL,
+        STOP_THREADS
+    ).start_thread()
+    heartbeat.sd_notify("READY=1")
 
     # Fill the mux channel queues with incomming data
+    beat = heartbeat.register("Main loop").beat
     last_purge_ts = time.time()
     while not STOP_THREADS.is_set():
+        beat()
         # DATA_QUEUE.put(b"!AIVDM,1,1,,B,403Ow3AunWje:r6>:`Hc@u?026Bl,0*3A")
         # This blocks forever until there is data on the DATA_QUEUE to handle
         data = None
         if not DATA_QUEUE.empty():
-            data = DATA_QUEUE.get()
+            source, data = DATA_QUEUE.get()
 
         if data:
-            mmsi, ship_length = parse_message(data)
-            mmsi_cache.update_vessel(mmsi=mmsi, length=ship_length)
-            reject = reject_ais(mmsi=mmsi, mmsi_cache=mmsi_cache, min_length=MIN_SHIP_LENGTH)
-            if reject:
-                LOGGER.info("REJECTING: %s, %s", mmsi, ship_length)
-            if not reject:
-                LOGGER.info("ACCEPTING: %s, %s", mmsi, ship_length)
-                for channel in mux_chans:
-                    if not channel.mux_queue.full():
-                        channel.mux_queue.put(data)
-                    else:
-                        LOGGER.error("MUX_QUEUE is full: %s", channel.name)
+            pipeline.run(Sentence(data, source))
 
         # Purge the MMSI_CACHE every so often
         if time.time() - last_purge_ts > 10:
             last_purge_ts = time.time()
-            LOGGER.info("MMSI_CACHE LEN: %s", len(mmsi_cache.cache))
-            mmsi_cache.purge(delete_age=60*60)
-            LOGGER.info("MMSI_CACHE PURGED. LEN: %s", len(mmsi_cache.cache))
+            purge_and_report(mmsi_cache, decode_cache, pipeline)
 
         time.sleep(0.001)
 
@@ -0,0 +1,341 @@
+#! /usr/bin/env python3
+"""
+NMEA Multiplexer - multi process (sharded) mode
+
+Runs the same channels and pipeline as nmea_mux2.py but spread over several
+processes so the work is not serialised under one GIL:
+
+    input process (one per input channel)
+        runs the channel and writes what it receives to its own ring
+    filter process
+        reads every input ring, runs the pipeline (cfg.PIPELINE_STAGES) and
+        routes the results to the output group rings
+    output process (one per output group, cfg.OUTPUT_GROUPS)
+        reads its ring and sends to its channels
+
+Processes are joined by shm_ring shared memory rings.  Each ring has exactly one
+writer and one reader and nothing is locked.  The writer never waits, so a
+stalled output process is lapped (and counts its lost sentences) rather than
+holding up ingest.  Each record is one sentence framed with the index of the
+channel (in cfg.CHANNELS) it came from or is going to.
+
+This process is the supervisor.  It creates the rings, starts the other
+processes and restarts any that die with the same backoff as the channel
+supervisor.  Each worker writes a heartbeat timestamp to a shared array on
+every pass round its loop.  A worker that is alive but has not beaten for
+cfg.HEARTBEAT_TIMEOUT is killed and restarted, and the systemd watchdog is only
+pinged while every worker is alive and beating.
+
+SIGUSR1 and SIGUSR2 (see profiling.py) profile the worker processes, each
+writing its own file.  The supervisor ignores them.  Run it instead of
+nmea_mux2.py:
+
+    python3 nmea_mux_sharded.py
+
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from queue import Empty
+
+import heartbeat
+import nmea_config as cfg
+import nmea_mux2 as mux
+import shm_ring
+from pipeline import Pipeline, Sentence
+
+LOGGER = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.001  # Seconds to sleep when there is nothing on the rings
+CHECK_INTERVAL = 1  # Seconds between process health checks
+REPORT_INTERVAL = 10  # Seconds
+
+
+def channel_names():
+    """Channel names in cfg.CHANNELS order.  The index is used to frame records"""
+    return [channel["name"] for channel in cfg.CHANNELS]
+
+
+def output_groups():
+    """Lists of output channel names, one list per output process"""
+    outputs = [channel["name"] for channel in cfg.CHANNELS if channel["is_mux"]]
+    groups = cfg.OUTPUT_GROUPS
+    if not groups:
+        return [[name] for name in outputs]
+
+    grouped = {name for group in groups for name in group}
+    # Anything not grouped gets a process of its own
+    return [list(group) for group in groups] + [[name] for name in outputs if name not in grouped]
+
+
+def frame(index, data):
+    """Prefix data with the channel index"""
+    return bytes((index,)) + data
+
+
+def beat(beats, slot):
+    """Record that the worker in slot is still going round its loop.
+    CLOCK_MONOTONIC is system wide so the supervisor can compare it.
+    """
+    beats[slot] = time.monotonic()
+
+
+def input_process(config, index, ring_name, beats, slot):
+    """Run one input channel and copy what it receives to its ring"""
+    mux.install_profiling_signals()
+    writer = shm_ring.RingWriter(ring_name, create=False)
+    supervisor = mux.ChannelSupervisor([config])
+    supervisor.start_all()
+    supervisor.start_thread()
+
+    while not mux.STOP_THREADS.is_set():
+        beat(beats, slot)
+        try:
+            _source, data = mux.DATA_QUEUE.get(timeout=1)
+        except Empty:
+            continue
+        try:
+            writer.write(frame(index, data))
+        except ValueError as err:
+            LOGGER.error("%s: %s", config["name"], err)
+
+
+class RingQueue:
+    """Looks like a mux_queue to the pipeline but writes framed records to a ring"""
+    def __init__(self, writer, index):
+        self.writer = writer
+        self.index = index
+
+    @staticmethod
+    def full():
+        """The ring never blocks"""
+        return False
+
+    def put(self, data):
+        """Write to the ring"""
+        try:
+            self.writer.write(frame(self.index, data))
+        except ValueError as err:
+            LOGGER.error("%s", err)
+
+
+class RingChannel:
+    """Stands in for an output channel in the filter process"""
+    def __init__(self, config, index, writer):
+        self.name = config["name"]
+        self.is_mux = True
+        self.mux_queue = RingQueue(writer, index)
+        interval = config.get("decimate_interval")
+        self.decimator = mux.Decimator(interval) if interval else None
+
+
+class RingRouter:
+    """The mux_chans and configs the pipeline routes to, backed by the output rings"""
+    def __init__(self, groups, ring_names):
+        names = channel_names()
+        configs = {channel["name"]: channel for channel in cfg.CHANNELS}
+        self.writers = [shm_ring.RingWriter(ring_name, create=False) for ring_name in ring_names]
+        self.configs = {}
+        self.mux_chans = []
+        for group, writer in zip(groups, self.writers):
+            for name in group:
+                self.configs[name] = configs[name]
+                self.mux_chans.append(RingChannel(configs[name], names.index(name), writer))
+
+
+def filter_process(input_ring_names, groups, output_ring_names, beats, slot):
+    """Run the pipeline from the input rings to the output rings"""
+    mux.install_profiling_signals()
+    names = channel_names()
+    readers = [shm_ring.RingReader(ring_name) for ring_name in input_ring_names]
+    router = RingRouter(groups, output_ring_names)
+    mmsi_cache = mux.MMSIcache()
+    decode_cache = mux.DecodeCache(cfg.DECODE_CACHE_ENTRIES)
+    pipeline = Pipeline(cfg.PIPELINE_STAGES, mux.MuxState(mmsi_cache, decode_cache, router))
+    if "decode" in pipeline.names:
+        threading.Thread(target=mux.load_ais_decoder, name="AIS decoder loader", daemon=True).start()
+
+    last_report_ts = time.time()
+    while True:
+        beat(beats, slot)
+        idle = True
+        for reader in readers:
+            for record in reader.read():
+                idle = False
+                pipeline.run(Sentence(record[1:], names[record[0]]))
+
+        if time.time() - last_report_ts > REPORT_INTERVAL:
+            last_report_ts = time.time()
+            mux.purge_and_report(mmsi_cache, decode_cache, pipeline)
+            for reader in readers:
+                if reader.lost:
+                    LOGGER.warning("Filter lost %s sentences from %s", reader.lost, reader.name)
+
+        if idle:
+            time.sleep(POLL_INTERVAL)
+
+
+def output_process(group, ring_name, beats, slot):
+    """Run a group of output channels fed from one ring"""
+    mux.install_profiling_signals()
+    names = channel_names()
+    configs = [channel for channel in cfg.CHANNELS if channel["name"] in group]
+    reader = shm_ring.RingReader(ring_name)
+    supervisor = mux.ChannelSupervisor(configs)
+    supervisor.start_all()
+    supervisor.start_thread()
+
+    last_report_ts = time.time()
+    while not mux.STOP_THREADS.is_set():
+        beat(beats, slot)
+        records = reader.read()
+        for record in records:
+            channel = supervisor.channels.get(names[record[0]])
+            if channel is not None and channel.is_alive():
+                mux.queue_for_channel(channel, record[1:])
+
+        if time.time() - last_report_ts > REPORT_INTERVAL:
+            last_report_ts = time.time()
+            if reader.lost:
+                LOGGER.warning("%s lost %s sentences", group, reader.lost)
+
+        if not records:
+            time.sleep(POLL_INTERVAL)
+
+
+class ProcessSupervisor:
+    """Start the worker processes and restart any that die"""
+    def __init__(self):
+        prefix = f"nmea_mux_{os.getpid()}"
+        capacity = cfg.SHARDED_RING_CAPACITY
+        names = channel_names()
+        groups = output_groups()
+
+        self.rings = []
+        self.specs = {}
+        input_rings = []
+        for channel in cfg.CHANNELS:
+            if channel["is_mux"]:
+                continue
+            ring_name = f"{prefix}_in{names.index(channel['name'])}"
+            self.rings.append(shm_ring.RingWriter(ring_name, capacity))
+            input_rings.append(ring_name)
+            self.specs[f"input {channel['name']}"] = (
+                input_process, (channel, names.index(channel["name"]), ring_name)
+            )
+
+        output_rings = []
+        for number, group in enumerate(groups):
+            ring_name = f"{prefix}_out{number}"
+            self.rings.append(shm_ring.RingWriter(ring_name, capacity))
+            output_rings.append(ring_name)
+            self.specs[f"output {', '.join(group)}"] = (output_process, (group, ring_name))
+
+        self.specs["filter"] = (filter_process, (input_rings, groups, output_rings))
+        self.processes = {}
+        self.incidents = {}
+        # One heartbeat timestamp per worker, shared with the worker processes
+        self.slots = {name: slot for slot, name in enumerate(self.specs)}
+        self.beats = multiprocessing.Array("d", len(self.specs), lock=False)
+
+    def start_process(self, name):
+        """Start the named worker process"""
+        target, args = self.specs[name]
+        slot = self.slots[name]
+        self.beats[slot] = time.monotonic()
+        process = multiprocessing.Process(
+            target=target, args=args + (self.beats, slot), name=name, daemon=True
+        )
+        process.start()
+        self.processes[name] = process
+        LOGGER.info("Started %s process, pid %s", name, process.pid)
+
+    def kill_if_stalled(self, name, process):
+        """Kill a process that is alive but has stopped beating.  Returns True if killed"""
+        age = time.monotonic() - self.beats[self.slots[name]]
+        if not process.is_alive() or age <= cfg.HEARTBEAT_TIMEOUT:
+            return False
+        LOGGER.error("%s process stalled, no heartbeat for %.1fs", name, age)
+        process.terminate()
+        process.join(timeout=1)
+        if process.is_alive():
+            process.kill()
+            process.join(timeout=1)
+        return True
+
+    def check(self):
+        """Restart dead or stalled processes once their backoff has expired.
+        Returns True if every process is alive and beating.
+        """
+        now = time.time()
+        healthy = True
+        for name, process in self.processes.items():
+            incident = self.incidents.get(name)
+            if self.kill_if_stalled(name, process):
+                healthy = False
+            if process.is_alive():
+                # Count it as recovered once a restarted process has stayed up for a check
+                if incident and incident["restarted"] and now - incident["restart_ts"] >= CHECK_INTERVAL:
+                    LOGGER.warning(
+                        "%s process recovered after %.1fs, %s restart attempts",
+                        name, now - incident["failed_ts"], incident["attempts"]
+                    )
+                    del self.incidents[name]
+                continue
+
+            healthy = False
+            if incident is None:
+                incident = {"failed_ts": now, "attempts": 0, "retry_ts": now, "restarted": False}
+                self.incidents[name] = incident
+            if incident["restarted"] or incident["attempts"] == 0:
+                LOGGER.error("%s process died, exit code %s", name, process.exitcode)
+                incident["restarted"] = False
+
+            if now >= incident["retry_ts"]:
+                incident["attempts"] += 1
+                incident["retry_ts"] = now + mux.backoff_delay(incident["attempts"], cfg.SUPERVISOR_MAX_BACKOFF)
+                incident["restart_ts"] = now
+                incident["restarted"] = True
+                self.start_process(name)
+        return healthy
+
+    def run(self):
+        """Start everything and supervise until we are told to stop"""
+        for name in self.specs:
+            self.start_process(name)
+        heartbeat.sd_notify("READY=1")
+        try:
+            while True:
+                time.sleep(CHECK_INTERVAL)
+                if self.check():
+                    heartbeat.sd_notify("WATCHDOG=1")
+        finally:
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join(timeout=5)
+            for ring in self.rings:
+                ring.close()
+
+
+def handle_sigterm(_signum, _frame):
+    """Exit via SystemExit so the rings are cleaned up"""
+    raise SystemExit(0)
+
+
+def main():
+    """Entry point"""
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    # The default action would kill the supervisor, and the workers until they
+    # have installed their own handlers
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    ProcessSupervisor().run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,140 @@
+#! /usr/bin/env python3
+
+""" On demand profiling for the running mux
+
+SamplingProfiler samples the stack of every thread (server threads and the main
+loop) with sys._current_frames() and writes the results to a timestamped file.
+Nothing is hooked into the interpreter so there is no cost until it is started,
+and the threads being profiled are not slowed down much while it runs.
+
+The output file has samples per thread, the functions that were running most
+often (self time) and folded stacks which can be fed straight into flamegraph.pl.
+
+nmea_mux2 starts a profile on SIGUSR1 and dumps the stacks of all threads on
+SIGUSR2:
+
+    sudo systemctl kill -s USR1 nmea_mux
+    sudo systemctl kill -s USR2 nmea_mux
+
+In sharded mode (nmea_mux_sharded.py) systemctl signals every process, and each
+worker process writes its own file.  The file names include the pid.
+
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+LOGGER = logging.getLogger(__name__)
+
+SAMPLE_INTERVAL = 0.005  # Seconds
+
+
+def timestamped_path(out_dir, kind):
+    """Return a file path like <out_dir>/nmea_mux_<kind>_20220430_120000_<pid>.txt"""
+    return os.path.join(out_dir, f"nmea_mux_{kind}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.txt")
+
+
+def thread_names():
+    """Map thread ident to name"""
+    return {thd.ident: thd.name for thd in threading.enumerate()}
+
+
+def dump_stacks(out_dir):
+    """Write the current stack of every thread to a file and return the path.
+    Returns None if the file could not be written.
+    """
+    names = thread_names()
+    path = timestamped_path(out_dir, "stacks")
+    try:
+        with open(path, mode="w", encoding="utf-8") as file:
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                file.write(f"Thread {names.get(ident, ident)}:\n")
+                file.writelines(traceback.format_stack(frame))
+                file.write("\n")
+    except OSError as err:
+        LOGGER.error("Unable to write thread stacks: %s", err)
+        return None
+    LOGGER.info("Thread stacks written to %s", path)
+    return path
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads for a fixed time"""
+    def __init__(self, out_dir, interval=SAMPLE_INTERVAL):
+        self.out_dir = out_dir
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def running(self):
+        """True while a profile is being collected"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, duration):
+        """Profile for duration seconds in a background thread"""
+        if self.running():
+            LOGGER.warning("Profiler already running")
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(duration,), name="Profiler", daemon=True)
+        self.thread.start()
+        LOGGER.info("Profiling all threads for %ss", duration)
+
+    def stop(self):
+        """Finish early.  The results are still written"""
+        self.stop_event.set()
+
+    def run(self, duration):
+        """Collect samples then write them out"""
+        me = threading.get_ident()
+        stacks = Counter()
+        end_ts = time.monotonic() + duration
+        samples = 0
+        while time.monotonic() < end_ts and not self.stop_event.wait(self.interval):
+            names = thread_names()
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+        self.write(stacks, samples)
+
+    def write(self, stacks, samples):
+        """Write per thread totals, top functions and folded stacks.
+        Returns the path, or None if the file could not be written.
+        """
+        per_thread = Counter()
+        self_time = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            per_thread[frames[0]] += count
+            self_time[frames[-1]] += count
+
+        path = timestamped_path(self.out_dir, "profile")
+        try:
+            with open(path, mode="w", encoding="utf-8") as file:
+                file.write(f"# {samples} samples every {self.interval * 1000:.1f} ms\n\n# Samples per thread\n")
+                for name, count in per_thread.most_common():
+                    file.write(f"{count:8d}  {name}\n")
+                file.write("\n# Top functions (self)\n")
+                for name, count in self_time.most_common(30):
+                    file.write(f"{count:8d}  {name}\n")
+                file.write("\n# Folded stacks\n")
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+        except OSError as err:
+            LOGGER.error("Unable to write profile: %s", err)
+            return None
+        LOGGER.info("Profile written to %s", path)
+        return path
@@ -0,0 +1,277 @@
+#! /usr/bin/env python3
+
+""" Shared memory ring buffer for NMEA sentences
+
+One writer appends framed records to a ring in shared memory.  Any number of
+readers map the same segment and follow the writer using the byte position and
+sequence number in the header.  The writer never waits for readers: if a reader
+falls a whole ring behind, it is lapped, counts the lost records and carries on
+from the current write position.  Nothing is locked so a slow or dead reader can
+never stall the writer.
+
+Layout:
+
+    header  [magic 8s][capacity Q][head Q][seq Q][generation Q][closed Q] padded to 64 bytes
+    data    capacity bytes of records
+
+    record  [length I][seq Q][payload]
+
+head is the total number of bytes ever written (so position % capacity is the
+offset in the data area) and seq is the number of records written.  The writer
+publishes head and seq only after a record is complete.  A record never wraps
+around the end of the ring; if it does not fit, the writer leaves a WRAP marker
+and starts again at offset 0.
+
+A channel restart creates a new segment under the same name.  Each segment has
+its own generation number, and the writer only removes the name on close if it
+still points at its own segment.  Closing sets the closed flag so attached
+readers know to attach to the replacement (RingReader.reattach).
+
+To follow a ring from the command line:
+
+    python3 shm_ring.py nmea_mux
+
+"""
+
+import logging
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"NMEARNG1"
+HEADER = struct.Struct("<8sQQQQQ")
+POSITION = struct.Struct("<QQ")
+POSITION_OFFSET = 16
+GENERATION = struct.Struct("<Q")
+GENERATION_OFFSET = 32
+CLOSED = struct.Struct("<Q")
+CLOSED_OFFSET = 40
+DATA_START = 64
+
+RECORD = struct.Struct("<IQ")
+WRAP = 0xFFFFFFFF
+
+MAX_PAYLOAD = 4096
+MAX_RECORD = RECORD.size + MAX_PAYLOAD
+DEFAULT_CAPACITY = 1 << 20  # 1MB
+
+
+def attach(name):
+    """Attach to an existing segment without registering it with the resource
+    tracker, which would unlink it when this process exits (it belongs to the writer).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)  # pylint: disable=unexpected-keyword-arg
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def generation_of(name):
+    """Generation of the segment the name currently points at, or None if there is none"""
+    try:
+        shm = attach(name)
+    except FileNotFoundError:
+        return None
+    try:
+        return GENERATION.unpack_from(shm.buf, GENERATION_OFFSET)[0]
+    finally:
+        shm.close()
+
+
+class RingWriter:
+    """Single writer for a shared memory ring.
+
+    With create=True (the default) the ring is created and owned by this writer
+    and removed by close().  With create=False we attach to a ring created
+    elsewhere (e.g. by a supervisor process) and carry on from its current
+    position, so a restarted writer process does not confuse its readers.
+    Only one writer may use a ring at a time.
+    """
+    def __init__(self, name, capacity=DEFAULT_CAPACITY, create=True):
+        self.name = name
+        self.owner = create
+        if not create:
+            self.shm = attach(name)
+            self.buf = self.shm.buf
+            magic, self.capacity, self.head, self.seq, self.generation, _ = HEADER.unpack_from(self.buf, 0)
+            if magic != MAGIC:
+                self.close()
+                raise ValueError(f"{name} is not an NMEA ring buffer")
+            return
+
+        if capacity < 4 * MAX_RECORD:
+            raise ValueError(f"Ring capacity must be at least {4 * MAX_RECORD} bytes")
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=DATA_START + capacity)
+        except FileExistsError:
+            # Left behind by a previous run that did not exit cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=DATA_START + capacity)
+
+        self.capacity = capacity
+        self.buf = self.shm.buf
+        self.head = 0
+        self.seq = 0
+        self.generation = time.time_ns() ^ os.getpid()
+        HEADER.pack_into(self.buf, 0, MAGIC, capacity, self.head, self.seq, self.generation, 0)
+
+    def write(self, data):
+        """Append one record.  Payloads longer than MAX_PAYLOAD are rejected"""
+        length = len(data)
+        if length > MAX_PAYLOAD:
+            raise ValueError(f"Record of {length} bytes is longer than {MAX_PAYLOAD}")
+
+        size = RECORD.size + length
+        offset = self.head % self.capacity
+        if offset + size > self.capacity:
+            # No room before the end of the ring so mark the gap and start again at 0
+            if self.capacity - offset >= 4:
+                struct.pack_into("<I", self.buf, DATA_START + offset, WRAP)
+            self.head += self.capacity - offset
+            offset = 0
+
+        start = DATA_START + offset
+        RECORD.pack_into(self.buf, start, length, self.seq)
+        self.buf[start + RECORD.size:start + size] = data
+        self.head += size
+        self.seq += 1
+        # Publish last so readers never see a half written record
+        POSITION.pack_into(self.buf, POSITION_OFFSET, self.head, self.seq)
+
+    def close(self):
+        """Close the segment.  If we created it, tell readers it is closed and remove
+        the name, unless the name has already been taken by a replacement ring.
+        """
+        if self.owner:
+            CLOSED.pack_into(self.buf, CLOSED_OFFSET, 1)
+        self.buf = None
+        self.shm.close()
+        if not self.owner or generation_of(self.name) != self.generation:
+            return
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RingReader:
+    """Follow a ring written by RingWriter.  Starts at the current write position"""
+    def __init__(self, name):
+        self.name = name
+        self.lost = 0
+        self.shm = None
+        self.buf = None
+        self.open()
+
+    def open(self, from_start=False):
+        """Attach to the segment the name points at.  Start at the current write
+        position, or with from_start at the first record (for a replacement ring).
+        """
+        self.shm = attach(self.name)
+        self.buf = self.shm.buf
+        magic, self.capacity, head, seq, self.generation, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.name} is not an NMEA ring buffer")
+        self.pos = 0 if from_start else head
+        self.seq = 0 if from_start else seq
+        # The writer may be part way through a record (plus a wrap gap) beyond
+        # head, so anything closer than this to being overwritten is unsafe.
+        self.safe_lag = self.capacity - 2 * MAX_RECORD
+
+    def closed(self):
+        """True if the writer has closed this segment"""
+        return CLOSED.unpack_from(self.buf, CLOSED_OFFSET)[0] != 0
+
+    def replaced(self):
+        """True if the name now points at a different segment (the writer restarted)"""
+        generation = generation_of(self.name)
+        return generation is not None and generation != self.generation
+
+    def reattach(self):
+        """Switch to the replacement segment.  Returns False if there is none yet"""
+        if not self.replaced():
+            return False
+        self.close()
+        self.open(from_start=True)
+        LOGGER.info("%s: Attached to the replacement ring", self.name)
+        return True
+
+    def resync(self, head, seq):
+        """We were lapped.  Count what we missed and jump to the write position"""
+        self.lost += seq - self.seq
+        self.pos = head
+        self.seq = seq
+
+    def read(self):
+        """Return a list of any new payloads"""
+        head, seq = POSITION.unpack_from(self.buf, POSITION_OFFSET)
+        if head - self.pos > self.safe_lag:
+            self.resync(head, seq)
+            return []
+
+        start_pos = self.pos
+        records = []
+        pos = self.pos
+        while pos < head:
+            offset = pos % self.capacity
+            if self.capacity - offset < RECORD.size:
+                pos += self.capacity - offset
+                continue
+            length, rec_seq = RECORD.unpack_from(self.buf, DATA_START + offset)
+            if length == WRAP:
+                pos += self.capacity - offset
+                continue
+            start = DATA_START + offset + RECORD.size
+            records.append(bytes(self.buf[start:start + length]))
+            pos += RECORD.size + length
+
+        # If the writer lapped us while we were copying the data may be torn
+        head_now, seq_now = POSITION.unpack_from(self.buf, POSITION_OFFSET)
+        if head_now - start_pos > self.safe_lag:
+            self.resync(head_now, seq_now)
+            return []
+
+        self.pos = pos
+        self.seq = seq
+        return records
+
+    def follow(self, poll_interval=0.01, check_interval=1):
+        """Generator that yields payloads as they are written.
+        Moves to a replacement ring if the writer closes or restarts.
+        """
+        last_check_ts = time.monotonic()
+        while True:
+            records = self.read()
+            if records:
+                yield from records
+                continue
+            if self.closed() or time.monotonic() - last_check_ts > check_interval:
+                last_check_ts = time.monotonic()
+                if self.reattach():
+                    continue
+            time.sleep(poll_interval)
+
+    def close(self):
+        """Detach from the segment"""
+        self.buf = None
+        if self.shm is not None:
+            self.shm.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    reader = RingReader(sys.argv[1] if len(sys.argv) > 1 else "nmea_mux")
+    for payload in reader.follow():
+        LOGGER.debug("%s (lost %s)", payload, reader.lost)
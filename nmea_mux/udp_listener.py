@@ -14,7 +14,7 @@ LOGGER = logging.getLogger(__name__)
 # Address
 NMEA_PORT = 10110
 ADDRESS = ("", NMEA_PORT)
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 65535  # Largest UDP datagram so nothing is truncated
 
 
 def listen_for_data():
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The mux modules import each other by module name (they run as scripts)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nmea_mux"))
@@ -0,0 +1,135 @@
+import pytest
+
+import ais_rules
+from ais_rules import AisRules, BitmaskMatcher, RangeMatcher, compile_rule, mid_of, parse_value
+from nmea_mux2 import MMSIcache, reject_ais
+
+
+def vessel(mmsi, ship_type=None, vessel_class=None, length=None):
+    return {"mmsi": mmsi, "mid": mid_of(mmsi), "type": ship_type, "class": vessel_class, "length": length}
+
+
+CLASS_A = ais_rules.VESSEL_CLASSES["A"]
+CLASS_B = ais_rules.VESSEL_CLASSES["B"]
+
+
+@pytest.mark.parametrize("mmsi, mid", [
+    (235012345, 235),   # ship
+    (2320001, 232),     # coast station 00MIDxxxx
+    (982351234, 235),   # craft associated with a ship
+    (992351234, 235),   # AtoN
+    (823512345, 235),   # handheld
+    (111232123, 232),   # SAR aircraft
+    (970123456, None),  # AIS-SART
+])
+def test_mid_of(mmsi, mid):
+    assert mid_of(mmsi) == mid
+
+
+@pytest.mark.parametrize("token, expected", [
+    ("20", (20, 20)),
+    ("20-50", (20, 50)),
+    ("<20", (0, 19)),
+    ("<=20", (0, 20)),
+    (">20", (21, ais_rules.NO_LIMIT)),
+    (">=20", (20, ais_rules.NO_LIMIT)),
+])
+def test_parse_value(token, expected):
+    assert parse_value(token, "length") == expected
+
+
+def test_parse_class():
+    assert parse_value("b", "class") == (CLASS_B, CLASS_B)
+
+
+def test_range_matcher_merges_overlapping_ranges():
+    matcher = RangeMatcher([(10, 20), (15, 30), (31, 40), (50, 60), (100, 100)], unknown=False)
+    assert matcher.starts == [10, 50]
+    assert matcher.ends == [40, 60]
+    assert [value for value in (9, 10, 35, 40, 41, 55, 61, 100, 101) if matcher(value)] == [10, 35, 40, 55, 100]
+    assert not matcher(None)
+
+
+def test_bitmask_matcher_clamps_open_ranges_to_the_limit():
+    matcher = BitmaskMatcher([(250, ais_rules.NO_LIMIT), (3, 3)], unknown=True, limit=255)
+    assert matcher(3)
+    assert matcher(255)
+    assert not matcher(249)
+    assert matcher(None)
+
+
+@pytest.mark.parametrize("rule", [
+    "",
+    "kill mmsi 1",
+    "allow colour red",
+    "allow type",
+    "allow type 256",
+    "allow type 20-10",
+    "allow length 50-20",
+    "deny class C",
+    "allow mmsi 1 and",
+    "allow length abc",
+])
+def test_bad_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        compile_rule(rule)
+
+
+def test_bad_default_action_is_rejected():
+    with pytest.raises(ValueError):
+        AisRules([], "maybe")
+
+
+RULES = AisRules([
+    "allow mmsi 235012345 235000000-235000100",
+    "allow type 60-69 80-89",
+    "deny type 36 37",
+    "deny mid 503",
+    "deny class B and length <12",
+    "deny length <20 unknown",
+])
+
+
+@pytest.mark.parametrize("target, allowed", [
+    (vessel(235012345, 36, CLASS_B, 5), True),     # our fleet beats every deny
+    (vessel(235000050, 36, CLASS_B, 5), True),     # fleet range
+    (vessel(235000101, 36, CLASS_A, 30), False),   # pleasure craft
+    (vessel(316000000, 60, CLASS_A, 5), True),     # passenger ship of any length
+    (vessel(503123456, 70, CLASS_A, 100), False),  # MID
+    (vessel(316000000, 70, CLASS_B, 11), False),   # small Class B
+    (vessel(316000000, 70, CLASS_B, 15), False),   # short
+    (vessel(316000000, 70, CLASS_A, None), False),  # unknown length
+    (vessel(316000000, 70, CLASS_A, 30), True),    # default
+    (vessel(316000000, None, None, 20), True),
+])
+def test_first_matching_rule_wins(target, allowed):
+    assert RULES.allows(target) == allowed
+
+
+def test_default_deny():
+    rules = AisRules(["allow type 80-89"], "deny")
+    assert rules.allows(vessel(316000000, 84))
+    assert not rules.allows(vessel(316000000, 70))
+
+
+def test_verdict_cached_until_vessel_attributes_change():
+    cache = MMSIcache()
+    rules = AisRules(["deny length <20"])
+    cache.update_vessel(316000000, msg_type=1)
+    assert not reject_ais(316000000, cache, rules)
+    assert cache.cache[316000000]["verdict"] is True
+
+    cache.update_vessel(316000000, length=15, ship_type=37, msg_type=24)
+    assert cache.cache[316000000]["verdict"] is None
+    assert cache.cache[316000000]["class"] == CLASS_B
+    assert reject_ais(316000000, cache, rules)
+    assert not reject_ais(None, cache, rules)
+
+
+def test_purge_drops_only_old_vessels():
+    cache = MMSIcache()
+    cache.update_vessel(1)
+    cache.update_vessel(2)
+    cache.cache[1]["timestamp"] -= 2 * 60 * 60
+    cache.purge(delete_age=60 * 60)
+    assert list(cache.cache) == [2]
@@ -0,0 +1,41 @@
+from nmea_mux2 import Decimator
+
+
+def test_position_reports_decimated_per_vessel():
+    decimator = Decimator(30)
+    start = decimator.bucket_start
+    assert decimator.allow(1, 1, now=start + 1)
+    assert not decimator.allow(1, 1, now=start + 10)
+    assert decimator.allow(2, 18, now=start + 10)
+    assert decimator.allow(1, 3, now=start + 31)
+
+
+def test_other_messages_always_pass():
+    decimator = Decimator(30)
+    start = decimator.bucket_start
+    assert decimator.allow(1, 5, now=start + 1)
+    assert decimator.allow(1, 5, now=start + 2)
+    assert decimator.allow(None, 1, now=start + 2)
+
+
+def test_previous_bucket_still_decimates():
+    decimator = Decimator(30)
+    start = decimator.bucket_start
+    assert decimator.allow(1, 1, now=start + 25)
+    # Next bucket, but only 10s since it was sent
+    assert not decimator.allow(1, 1, now=start + 35)
+    # Two buckets on, the history is dropped
+    assert decimator.allow(1, 1, now=start + 100)
+
+
+def test_full_decimator_evicts_oldest_only():
+    decimator = Decimator(30, max_vessels=3)
+    start = decimator.bucket_start
+    for mmsi in (1, 2, 3, 4):
+        assert decimator.allow(mmsi, 1, now=start + mmsi)
+    assert len(decimator.current) + len(decimator.previous) == 3
+    assert decimator.evictions == 1
+    # 1 was evicted so passes again, the others are still decimated
+    assert not decimator.allow(4, 1, now=start + 10)
+    assert not decimator.allow(3, 1, now=start + 10)
+    assert decimator.allow(1, 1, now=start + 10)
@@ -0,0 +1,132 @@
+from queue import Queue
+
+import pytest
+
+import nmea_mux2
+from nmea_mux2 import DecodeCache, MMSIcache, MultipartAssembler, MuxState, parse_message
+from pipeline import Pipeline, Sentence
+
+STATIC = (
+    b"!AIVDM,2,1,1,A,538CQ>02A;h?D9QC800pu8@T>0P4l9E8L0000017Ah:;;5r50Ahm5;C0,0*07",
+    b"!AIVDM,2,2,1,A,F@V@00000000000,2*35",
+)
+POSITION = b"!AIVDM,1,1,,A,14eG;C@011r6mV0Hb9M8CnVL0<0;,0*10"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def decoder():
+    nmea_mux2.load_ais_decoder()
+
+
+def test_decode_static_report():
+    assert parse_message(*STATIC) == (210035000, 152, 5, 71)
+
+
+def test_position_report_has_no_length_or_ship_type():
+    assert parse_message(POSITION) == (316001101, None, 1, None)
+
+
+@pytest.mark.parametrize("data", [
+    b"!AIVDM,1,1,,B,,0*00",
+    b"!AIVDM,1,1,,B,14eG;C@011r6mV0Hb9M8CnVL0<0;",
+    b"!AIVDM,1,1,,A,\xff\xfe,0*00",
+])
+def test_corrupt_sentences_do_not_raise(data):
+    assert parse_message(data, decode_cache=DecodeCache(10))[0] in (None, 0)
+
+
+def test_multipart_fragment_is_not_decoded():
+    assert parse_message(STATIC[0]) == (None, None, None, None)
+    assert parse_message(*reversed(STATIC)) == (None, None, None, None)
+
+
+def test_decode_cache_hits_same_payload_on_either_channel():
+    cache = DecodeCache(10)
+    assert parse_message(POSITION, decode_cache=cache) == parse_message(
+        POSITION.replace(b",A,", b",B,"), decode_cache=cache
+    )
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_decode_cache_hits_multipart_with_another_sequence_id():
+    cache = DecodeCache(10)
+    resent = tuple(part.replace(b",1,A,", b",7,B,") for part in STATIC)
+    assert parse_message(*STATIC, decode_cache=cache) == (210035000, 152, 5, 71)
+    assert parse_message(*resent, decode_cache=cache) == (210035000, 152, 5, 71)
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_decode_cache_evicts_least_recently_used():
+    cache = DecodeCache(2)
+    cache.put(b"a", 1)
+    cache.put(b"b", 2)
+    assert cache.get(b"a") == 1
+    cache.put(b"c", 3)
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == 1
+    assert cache.get(b"c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_assembler_returns_the_message_once_complete():
+    assembler = MultipartAssembler()
+    assert assembler.add("ais", POSITION) == [POSITION]
+    assert assembler.add("ais", STATIC[0], now=100) is None
+    assert assembler.add("ais", STATIC[1], now=101) == list(STATIC)
+    assert assembler.pending == {}
+
+
+def test_assembler_keeps_sources_apart_and_drops_orphans():
+    assembler = MultipartAssembler()
+    assert assembler.add("ais", STATIC[0], now=100) is None
+    assert assembler.add("gateway", STATIC[1], now=100) is None
+    assert assembler.add("ais", STATIC[1], now=100) == list(STATIC)
+    assert assembler.dropped == 1
+
+
+def test_assembler_drops_old_and_excess_fragments():
+    assembler = MultipartAssembler(max_pending=2, max_age=5)
+    assert assembler.add("ais", STATIC[0], now=100) is None
+    assert assembler.add("ais", STATIC[1], now=106) is None
+    assert assembler.dropped == 2
+
+    for source in ("a", "b", "c"):
+        assembler.add(source, STATIC[0], now=110)
+    assert [key[0] for key in assembler.pending] == ["b", "c"]
+    assert assembler.add("a", STATIC[1], now=110) is None
+
+
+class Channel:
+    is_mux = True
+    decimator = None
+
+    def __init__(self, name):
+        self.name = name
+        self.mux_queue = Queue()
+
+
+class Channels:
+    def __init__(self):
+        self.configs = {"plotter": {}}
+        self.mux_chans = [Channel("plotter")]
+
+
+@pytest.mark.parametrize("rules, routed", [
+    (["deny class A and type 70-79 and length >100"], False),
+    (["deny length <20 unknown"], True),
+])
+def test_pipeline_reassembles_static_report_before_filtering(monkeypatch, rules, routed):
+    monkeypatch.setattr(nmea_mux2.cfg, "AIS_RULES", rules)
+    mmsi_cache = MMSIcache()
+    channels = Channels()
+    state = MuxState(mmsi_cache, DecodeCache(10), channels)
+    pipeline = Pipeline(["decode", "track", "ais_filter", "route"], state)
+
+    assert not pipeline.run(Sentence(STATIC[0] + b"\r\n", "ais"))
+    assert channels.mux_chans[0].mux_queue.empty()
+    assert pipeline.run(Sentence(STATIC[1] + b"\r\n", "ais")) is routed
+
+    vessel = mmsi_cache.cache[210035000]
+    assert (vessel["length"], vessel["type"], vessel["class"]) == (152, 71, 0)
+    if routed:
+        assert channels.mux_chans[0].mux_queue.get_nowait() == STATIC[0] + b"\r\n" + STATIC[1] + b"\r\n"
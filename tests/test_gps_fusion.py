@@ -0,0 +1,99 @@
+from queue import Queue
+
+import gps_fusion
+import nmea_mux2
+from gps_fusion import GpsFusion
+from pipeline import Sentence
+
+
+def gga(quality=b"1", sats=b"8", hdop=b"1.0"):
+    return b"$GPGGA,120000,5000.0,N,00100.0,W," + quality + b"," + sats + b"," + hdop + b",10,M,,,,*00"
+
+
+def rmc(status=b"A"):
+    return b"$GPRMC,120000," + status + b",5000.0,N,00100.0,W,0.0,0.0,010122,,*00"
+
+
+def gsa(mode):
+    return b"$GPGSA,A," + mode + b",01,02,03,04,,,,,,,,,2.0,1.0,1.5*00"
+
+
+def test_first_source_passes_until_one_has_a_fix():
+    fusion = GpsFusion(max_age=3)
+    assert fusion.update("usb", rmc(b"V"), now=100)
+    assert not fusion.update("ais", rmc(b"V"), now=100)
+
+
+def test_fails_over_to_a_live_source():
+    fusion = GpsFusion(max_age=3)
+    assert fusion.update("usb", gga(), now=100)
+    assert not fusion.update("ais", gga(), now=101)
+    # usb has not had a fix for max_age
+    assert fusion.update("ais", gga(), now=104)
+    assert fusion.selected.name == "ais"
+    assert not fusion.update("usb", gga(b"0"), now=105)
+
+
+def test_switches_to_a_better_class_of_fix_only():
+    fusion = GpsFusion(max_age=3)
+    fusion.update("usb", gga(sats=b"5"), now=100)
+    # More satellites is not enough to switch
+    assert not fusion.update("ais", gga(sats=b"12"), now=100)
+    # A differential fix is
+    assert fusion.update("ais", gga(quality=b"2"), now=101)
+    assert fusion.selected.name == "ais"
+
+
+def test_gsa_mode_1_means_no_fix():
+    fusion = GpsFusion(max_age=3)
+    fusion.update("usb", gga(), now=100)
+    fusion.update("usb", gsa(b"1"), now=100)
+    assert not fusion.sources["usb"].has_fix
+
+
+def test_consolidated_is_latest_position_set_in_order():
+    fusion = GpsFusion(max_age=3)
+    fusion.update("usb", gga(), now=100)
+    fusion.update("usb", rmc(), now=100)
+    fusion.update("usb", gsa(b"3"), now=100)
+    assert fusion.consolidated() == [rmc(), gga(), gsa(b"3")]
+
+
+def test_is_position():
+    assert gps_fusion.is_position(gga())
+    assert gps_fusion.is_position(b"$GNRMC,120000,A*00")
+    assert not gps_fusion.is_position(b"$GPGSV,3,1,11,01,02,03,04*00")
+    assert not gps_fusion.is_position(b"$GPAPB,A,A,0.10,R,N,V,V,011,M,DEST,011,M,011,M*00")
+    assert not gps_fusion.is_position(b"!AIVDM,1,1,,A,14eG;C@011r6mV0Hb9M8CnVL0<0;,0*10")
+
+
+class Channel:
+    is_mux = True
+    decimator = None
+
+    def __init__(self, name):
+        self.name = name
+        self.mux_queue = Queue()
+
+
+class Channels:
+    def __init__(self, configs):
+        self.configs = configs
+        self.mux_chans = [Channel(name) for name in configs]
+
+
+def test_gps_stage_passes_non_position_sentences_on():
+    channels = Channels({"plotter": {}, "slow": {"gps_rate": 1}})
+    gps = nmea_mux2.gps_stage(nmea_mux2.MuxState(None, None, channels))
+    for data in (b"$GPAPB,A,A,0.10,R,N,V,V,011,M,DEST,011,M,011,M*00", b"$GPGSV,3,1,11,01*00"):
+        assert gps(Sentence(data, "tcp"))
+    assert all(channel.mux_queue.empty() for channel in channels.mux_chans)
+
+
+def test_gps_stage_routes_position_sentences_from_selected_source():
+    channels = Channels({"plotter": {}})
+    gps = nmea_mux2.gps_stage(nmea_mux2.MuxState(None, None, channels))
+    assert not gps(Sentence(gga(), "usb"))
+    assert not gps(Sentence(gga(), "ais"))
+    assert channels.mux_chans[0].mux_queue.get_nowait() == gga()
+    assert channels.mux_chans[0].mux_queue.empty()
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import nmea_config as cfg
+import nmea_mux_sharded as sharded
+import shm_ring
+
+CHANNELS = [
+    {"type": "UDP", "is_mux": False, "address": ("0.0.0.0", 10110), "name": "AIS in"},
+    {"type": "TCP", "is_mux": True, "address": ("0.0.0.0", 10111), "name": "TCP out"},
+    {"type": "UDP", "is_mux": True, "address": ("127.0.0.1", 10112), "name": "UDP out"},
+    {"type": "SERIAL", "is_mux": True, "port": "/dev/ttyUSB0", "baud": 38400, "name": "UART out"},
+]
+
+
+@pytest.fixture
+def channels(monkeypatch):
+    monkeypatch.setattr(cfg, "CHANNELS", CHANNELS)
+    monkeypatch.setattr(cfg, "OUTPUT_GROUPS", [])
+
+
+@pytest.fixture
+def ring_names(request):
+    names = [f"nmea_mux_test_{os.getpid()}_{request.node.name}_{number}" for number in range(2)]
+    yield names
+    for name in names:
+        if os.path.exists(f"/dev/shm/{name}"):
+            os.unlink(f"/dev/shm/{name}")
+
+
+def sleeper(beats, slot):
+    """A worker that beats once then sleeps without beating"""
+    sharded.beat(beats, slot)
+    time.sleep(60)
+
+
+def test_each_output_gets_a_process_when_not_grouped(channels):
+    assert sharded.output_groups() == [["TCP out"], ["UDP out"], ["UART out"]]
+
+
+def test_grouped_outputs_share_a_process(channels, monkeypatch):
+    monkeypatch.setattr(cfg, "OUTPUT_GROUPS", [["UDP out", "TCP out"]])
+    assert sharded.output_groups() == [["UDP out", "TCP out"], ["UART out"]]
+
+
+def test_router_writes_to_the_ring_of_the_channel_group(channels, ring_names):
+    groups = [["TCP out", "UART out"], ["UDP out"]]
+    owners = [shm_ring.RingWriter(name, 4 * shm_ring.MAX_RECORD) for name in ring_names]
+    readers = [shm_ring.RingReader(name) for name in ring_names]
+    router = sharded.RingRouter(groups, ring_names)
+    try:
+        assert [channel.name for channel in router.mux_chans] == ["TCP out", "UART out", "UDP out"]
+        for channel in router.mux_chans:
+            channel.mux_queue.put(channel.name.encode())
+
+        first, second = (reader.read() for reader in readers)
+        assert first == [sharded.frame(1, b"TCP out"), sharded.frame(3, b"UART out")]
+        assert second == [sharded.frame(2, b"UDP out")]
+        assert sharded.channel_names()[second[0][0]] == "UDP out"
+    finally:
+        for ring in readers + router.writers + owners:
+            ring.close()
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    monkeypatch.setattr(cfg, "CHANNELS", [])
+    monkeypatch.setattr(cfg, "HEARTBEAT_TIMEOUT", 0.5)
+    sup = sharded.ProcessSupervisor()
+    sup.specs = {"sleeper": (sleeper, ())}
+    sup.slots = {"sleeper": 0}
+    sup.beats = multiprocessing.Array("d", 1, lock=False)
+    yield sup
+    for process in sup.processes.values():
+        process.kill()
+        process.join(timeout=1)
+
+
+def test_check_restarts_a_dead_process(supervisor):
+    supervisor.start_process("sleeper")
+    first = supervisor.processes["sleeper"]
+    assert supervisor.check()
+
+    first.kill()
+    first.join(timeout=1)
+    assert not supervisor.check()
+    restarted = supervisor.processes["sleeper"]
+    assert restarted.pid != first.pid
+    assert restarted.is_alive()
+    assert supervisor.incidents["sleeper"]["attempts"] == 1
+
+
+def test_check_kills_and_restarts_a_stalled_process(supervisor):
+    supervisor.start_process("sleeper")
+    first = supervisor.processes["sleeper"]
+    time.sleep(1)
+
+    assert not supervisor.check()
+    assert not first.is_alive()
+    assert supervisor.processes["sleeper"].is_alive()
+    assert supervisor.processes["sleeper"].pid != first.pid
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+import shm_ring
+
+CAPACITY = 4 * shm_ring.MAX_RECORD
+
+
+@pytest.fixture
+def ring_name(request):
+    name = f"nmea_mux_test_{os.getpid()}_{request.node.name}"
+    yield name
+    if os.path.exists(f"/dev/shm/{name}"):
+        os.unlink(f"/dev/shm/{name}")
+
+
+def test_reader_gets_records_written_after_it_attached(ring_name):
+    writer = shm_ring.RingWriter(ring_name, CAPACITY)
+    writer.write(b"before")
+    reader = shm_ring.RingReader(ring_name)
+    assert reader.read() == []
+    writer.write(b"one")
+    writer.write(b"two")
+    assert reader.read() == [b"one", b"two"]
+    assert reader.read() == []
+    reader.close()
+    writer.close()
+
+
+def test_records_wrap_around_the_end_of_the_ring(ring_name):
+    writer = shm_ring.RingWriter(ring_name, CAPACITY)
+    reader = shm_ring.RingReader(ring_name)
+    payload = b"x" * 1000
+    received = []
+    for number in range(100):
+        writer.write(payload + b"%d" % number)
+        received += reader.read()
+    assert received == [payload + b"%d" % number for number in range(100)]
+    assert reader.lost == 0
+    reader.close()
+    writer.close()
+
+
+def test_lapped_reader_counts_lost_records_and_carries_on(ring_name):
+    writer = shm_ring.RingWriter(ring_name, CAPACITY)
+    reader = shm_ring.RingReader(ring_name)
+    for _ in range(100):
+        writer.write(b"x" * 1000)
+    assert reader.read() == []
+    assert reader.lost == 100
+    writer.write(b"after")
+    assert reader.read() == [b"after"]
+    reader.close()
+    writer.close()
+
+
+def test_oversized_record_is_rejected(ring_name):
+    writer = shm_ring.RingWriter(ring_name, CAPACITY)
+    with pytest.raises(ValueError):
+        writer.write(b"x" * (shm_ring.MAX_PAYLOAD + 1))
+    writer.close()
+
+
+def test_attached_writer_carries_on_from_the_current_position(ring_name):
+    owner = shm_ring.RingWriter(ring_name, CAPACITY)
+    owner.write(b"one")
+    reader = shm_ring.RingReader(ring_name)
+    writer = shm_ring.RingWriter(ring_name, create=False)
+    writer.write(b"two")
+    writer.close()
+    assert reader.read() == [b"two"]
+    # Only the owner removes the ring
+    assert os.path.exists(f"/dev/shm/{ring_name}")
+    reader.close()
+    owner.close()
+    assert not os.path.exists(f"/dev/shm/{ring_name}")
+
+
+def test_closing_a_replaced_writer_leaves_the_replacement(ring_name):
+    old = shm_ring.RingWriter(ring_name, CAPACITY)
+    reader = shm_ring.RingReader(ring_name)
+    new = shm_ring.RingWriter(ring_name, CAPACITY)
+    old.close()
+    assert os.path.exists(f"/dev/shm/{ring_name}")
+
+    assert reader.closed()
+    new.write(b"from the new ring")
+    assert reader.reattach()
+    assert reader.read() == [b"from the new ring"]
+    assert not reader.reattach()
+    reader.close()
+    new.close()
+    assert not os.path.exists(f"/dev/shm/{ring_name}")
@@ -0,0 +1,19 @@
+import time
+
+from nmea_mux2 import ChannelSupervisor
+
+MISSING_UART_MUX = {"type": "SERIAL", "is_mux": True, "port": "/dev/nmea_mux_missing", "baud": 4800, "name": "UART MUX"}
+
+
+def test_channel_that_fails_to_open_is_not_routed_to():
+    supervisor = ChannelSupervisor([MISSING_UART_MUX])
+    supervisor.start_all()
+    assert supervisor.mux_chans == []
+
+    # Fails, is restarted straight away and fails again.  It must not stay
+    # routed to while it waits for its next restart.
+    for _ in range(3):
+        time.sleep(0.1)
+        supervisor.check()
+        assert supervisor.mux_chans == []
+    assert supervisor.incidents["UART MUX"]["attempts"] == 1
@@ -0,0 +1,61 @@
+import select
+import socket
+
+import pytest
+
+import nmea_mux2
+from nmea_mux2 import DATA_QUEUE, UDPInput, drain_queue
+
+POSITION = b"!AIVDM,1,1,,A,14eG;C@011r6mV0Hb9M8CnVL0<0;,0*10"
+GPS = b"$GPRMC,123519,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A"
+
+
+@pytest.fixture
+def udp_input(monkeypatch):
+    # Drive drain() from the test rather than the worker thread
+    monkeypatch.setattr(UDPInput, "start_thread", lambda self: None)
+    drain_queue(DATA_QUEUE, timeout=0)
+    channel = UDPInput(("127.0.0.1", 0), "UDP test")
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(channel.socket.getsockname())
+    yield channel, sender
+    sender.close()
+    channel.socket.close()
+    drain_queue(DATA_QUEUE, timeout=0)
+
+
+def wait_readable(channel):
+    readable, _, _ = select.select([channel.socket], [], [], 1)
+    assert readable
+
+
+def test_datagram_is_split_into_sentences(udp_input):
+    channel, sender = udp_input
+    sender.send(POSITION + b"\r\n" + GPS + b"\r\n\r\n")
+    wait_readable(channel)
+    channel.drain()
+    assert drain_queue(DATA_QUEUE, timeout=0) == [("UDP test", POSITION), ("UDP test", GPS)]
+    assert (channel.datagrams, channel.sentences, channel.queue_drops) == (1, 2, 0)
+
+
+def test_drain_reads_at_most_one_batch(udp_input):
+    channel, sender = udp_input
+    for _ in range(5):
+        sender.send(POSITION)
+    wait_readable(channel)
+    channel.drain(max_datagrams=2)
+    assert channel.datagrams == 2
+    channel.drain(max_datagrams=2)
+    channel.drain(max_datagrams=2)
+    channel.drain(max_datagrams=2)
+    assert channel.datagrams == 5
+    assert len(drain_queue(DATA_QUEUE, timeout=0)) == 5
+
+
+def test_full_queue_is_counted(udp_input, monkeypatch):
+    channel, sender = udp_input
+    monkeypatch.setattr(nmea_mux2, "DATA_QUEUE", type(DATA_QUEUE)(maxsize=1))
+    sender.send(POSITION + b"\n" + GPS)
+    wait_readable(channel)
+    channel.drain()
+    assert (channel.sentences, channel.queue_drops) == (2, 1)
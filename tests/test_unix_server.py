@@ -0,0 +1,39 @@
+import socket
+
+import pytest
+
+from nmea_mux2 import UnixServer
+
+
+def test_stream_socket_refuses_to_replace_a_regular_file(tmp_path):
+    path = tmp_path / "nmea.sock"
+    path.write_text("not a socket")
+    with pytest.raises(FileExistsError):
+        UnixServer(str(path), "Local")
+    assert path.read_text() == "not a socket"
+
+
+def test_stream_socket_replaces_a_stale_socket(tmp_path):
+    path = str(tmp_path / "nmea.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+
+    server = UnixServer(path, "Local")
+    try:
+        assert server.owns_path()
+    finally:
+        server.stop()
+
+
+def test_dgram_drops_are_logged_once(caplog):
+    server = UnixServer(None, "Local", socket_type="dgram")
+    try:
+        server.dropped = 3
+        server.log_stats()
+        server.log_stats()
+    finally:
+        server.stop()
+    warnings = [record for record in caplog.records if "Dropped" in record.getMessage()]
+    assert len(warnings) == 1
+    assert "Dropped 3 datagrams" in warnings[0].getMessage()